@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+"""Serve comment long-polls from gevent greenlets
+
+Route /action/wait_comments/ to this server, other urls stay on usual
+workers, for example:
+
+    python push.py 127.0.0.1:8001
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import sys
+sys.path.insert(0, 'src')
+os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+
+from gevent.pywsgi import WSGIServer
+from django.core.handlers.wsgi import WSGIHandler
+
+
+if __name__ == "__main__":
+    host, port = (sys.argv[1:] or ['127.0.0.1:8001'])[0].rsplit(':', 1)
+    WSGIServer((host, int(port)), WSGIHandler()).serve_forever()
@@ -1,4 +1,7 @@
 KEYWORD_MIN_COUNT = 50
+TAG_CLOUD_MIN_COUNT = 20
+TAG_CLOUD_STEPS = 9
+TAGSTATS_TIME = 86400
 PUBSUB = False
 EMAIL_HOST = 'localhost'
 DEFAULT_FROM_EMAIL = 'webmaster@localhost'
@@ -20,6 +23,13 @@ COMMENT_RATE_COEFFICIENT = 0.1
 DEFAULT_CACHE_TIME = 0
 MENU_CACHE_TIME = 0
 SIDEBAR_CACHE_TIME = 0
+SIDEBAR_SNAPSHOT_TIME = 60
+LEADERBOARD_SIZE = 100
+LEADERBOARD_TIME = 3600
+ACTIVITY_SIZE = 100
+ACTIVITY_TIME = 86400
+CAPABILITIES_TIME = 86400
+COMMENT_TREE_TIME = 86400
 DEFAULT_AVATAR = '/media/style/figure.gif'
 LOGIN_REDIRECT_URL = '/'
 RECAPTCHA_PUBLIC_KEY = '6LeLNMISAAAAAI2FBbNBnjf_ms6a5werjXbTbNCk '
@@ -37,6 +47,24 @@ COMPRESS_CSS_FILTERS = ['compressor.filters.yui.YUICSSFilter',]
 API_KEY = "API_KEY"
 FULLNAME = 'Full site name'
 ONLINE_TIME = 600
+LENTA_COUNTER_TIME = 86400
+PRESENCE_FLUSH_TIME = 30
+PRESENCE_RESOLUTION = 60
+PRESENCE_LOG_TIME = 86400
+LAST_VIEW_FLUSH_TIME = 30
+LAST_VIEW_TIME = 86400
+COMMENT_WAIT_TIMEOUT = 25
+COMMENT_WAIT_INTERVAL = 1
+COMMENT_POLL_INTERVAL = 10
+COMMENT_BROKER = 'main.broker.CacheBroker'
+COMMENT_TREE_BACKEND = 'ns'
+COMMENT_WINDOW_SIZE = 200
+COUNT_MODE = 'cached'
+COUNT_TIME = 3600
+COUNT_EXACT_THRESHOLD = 10000
+TAG_INDEX_TIME = 86400
+RELATED_POSTS_COUNT = 10
+RELATED_POSTS_CHUNK = 1000
 INTERNAL_IPS = ('127.0.0.1:8000',)
 
 
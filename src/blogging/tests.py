@@ -23,6 +23,8 @@ from blogging.forms import (
     BlogForm,
 )
 from accounts.middleware import _thread_locals
+from tools.paginator import CursorPaginated
+import base64
 
 
 class ModelsTest(TestCase):
@@ -250,6 +252,40 @@ class ModelsTest(TestCase):
             [posts[5]],
         )
 
+    def test_cursor_pagination(self):
+        """Test keyset pagination"""
+        blog = Blog.objects.create(name='blog', author=self.root)
+        posts = map(lambda i: Post.objects.create(
+            title=str(i), preview='fsd', author=self.root,
+            content='esd', blog=blog,
+        ), range(5))
+        page = CursorPaginated(blog.get_posts(), per_page=2)
+        self.assertEqual(list(page), [posts[4], posts[3]])
+        self.assertFalse(page.prev_page_available())
+        page = CursorPaginated(blog.get_posts(), page.next_cursor(), per_page=2)
+        self.assertEqual(list(page), [posts[2], posts[1]])
+        page = CursorPaginated(blog.get_posts(), page.next_cursor(), per_page=2)
+        self.assertEqual(list(page), [posts[0]])
+        self.assertFalse(page.next_page_available())
+        page = CursorPaginated(blog.get_posts(), page.prev_cursor(), per_page=2)
+        self.assertEqual(list(page), [posts[2], posts[1]])
+        self.assertTrue(page.prev_page_available())
+        page = CursorPaginated(blog.get_posts(), page.prev_cursor(), per_page=2)
+        self.assertEqual(list(page), [posts[4], posts[3]])
+        self.assertFalse(page.prev_page_available())
+        for cursor in ('broken', base64.urlsafe_b64encode('[1, 2]'),
+                       base64.urlsafe_b64encode('[false, "x", 1]'),
+                       base64.urlsafe_b64encode('[false, null, 1]')):
+            page = CursorPaginated(blog.get_posts(), cursor, per_page=2)
+            self.assertEqual(list(page), [posts[4], posts[3]])
+            self.assertFalse(page.prev_page_available())
+        cursor = page.encode(posts[4], True)
+        page = CursorPaginated(blog.get_posts(), cursor, per_page=2)
+        self.assertEqual(list(page), [])
+        self.assertFalse(page.next_page_available())
+        self.assertEqual(page.next_cursor(), None)
+        self.assertEqual(page.prev_cursor(), None)
+
 
 class FormsTest(TestCase):
     def setUp(self):
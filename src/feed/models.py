@@ -14,9 +14,10 @@
 #       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #       MA 02110-1301, USA.
 from django_push.publisher.feeds import Feed
-from tagging.models import TaggedItem
 from django.contrib.auth.models import User
 from main.models import BlogType, Post, Blog
+from main.timelines import TimelinePosts, MAIN, blog_type_timeline
+from main import tagindex
 from django.conf import settings
 from django.utils.translation import ugettext as _
 
@@ -29,7 +30,7 @@ class PostFeed(Feed):
         if BlogType.check(type):
             blog_type = BlogType.objects.get(name=type)
             self.description = _('Posts in %s') % (blog_type.name)
-            return Post.objects.filter(blog__in=blog_type.get_blogs())
+            return TimelinePosts(blog_type_timeline(blog_type), pinned=False)
         if type == 'auth':
             self.description = _('Posts by %s') % (value)
             return Post.objects.filter(
@@ -42,15 +43,13 @@ class PostFeed(Feed):
             )
         elif type == 'tag':
             self.description = _('Posts with tag %s') % (value)
-            return TaggedItem.objects.get_by_model(Post, value)
+            return tagindex.get_posts(value)
         else:
-            blog_types = BlogType.objects.filter(display_default=False)
-            blogs = Blog.objects.filter(type__in=blog_types)
-            return Post.objects.exclude(blog__in=blogs).filter(
-                rate__gt=getattr(settings, 'POST_RATE_TO_MAIN')
-            )
+            return TimelinePosts(MAIN, pinned=False)
 
     def items(self, obj):
+        if isinstance(obj, TimelinePosts):
+            return obj[:50]
         return obj.order_by('-id')[:50]
 
     def item_link(self, item):
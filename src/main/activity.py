@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.core.cache import cache
+from baseutils.jrpc import to_json
+from main.utils import get_version, bump_version
+
+
+ACTIVITY_CACHE_KEY = 'main_activity'
+ACTIVITY_SIZE = getattr(settings, 'ACTIVITY_SIZE', 100)
+ACTIVITY_TIME = getattr(settings, 'ACTIVITY_TIME', 24 * 60 * 60)
+TYPE_POST = 'post'
+TYPE_COMMENT = 'comment'
+
+
+def _owner(post):
+    return post.blog and post.blog.name or post.author.username
+
+
+def serialize_post(post):
+    """Make activity entry from post"""
+    owner = _owner(post)
+    return {
+        'type': TYPE_POST,
+        'id': post.id,
+        'post_id': post.id,
+        'date': post.date,
+        'title': u"%s &ndash; %s" % (owner, post.title),
+        'url': '/post/%d/' % (post.id,),
+        'rate': post.rate,
+        'owner': owner,
+        'post_title': post.title,
+        'json': to_json(post),
+    }
+
+
+def serialize_comment(comment):
+    """Make activity entry from comment"""
+    owner = _owner(comment.post)
+    author = comment.author.username if comment.author else ''
+    return {
+        'type': TYPE_COMMENT,
+        'id': comment.id,
+        'post_id': comment.post.id,
+        'date': comment.created,
+        'title': u"%s / %s &ndash; %s" % (author, owner, comment.post.title),
+        'url': '/post/%d/#cmnt%d' % (comment.post.id, comment.id),
+        'rate': comment.rate,
+        'author': author,
+        'owner': owner,
+        'post_title': comment.post.title,
+        'json': to_json(comment),
+    }
+
+
+def _buffer_key():
+    return '%s_%s' % (
+        ACTIVITY_CACHE_KEY, get_version(ACTIVITY_CACHE_KEY, ACTIVITY_TIME),
+    )
+
+
+def rebuild():
+    """Fill buffer from db"""
+    from main.models import Post, Comment
+    activity = {
+        TYPE_POST: map(serialize_post, Post.objects.select_related(
+            'blog', 'author',
+        ).order_by('-id')[:ACTIVITY_SIZE]),
+        TYPE_COMMENT: map(serialize_comment, Comment.objects.exclude(
+            depth=1,
+        ).exclude(
+            is_removed=True,
+        ).select_related(
+            'author', 'post', 'post__blog', 'post__author',
+        ).order_by('-id')[:ACTIVITY_SIZE]),
+    }
+    cache.set(_buffer_key(), activity, ACTIVITY_TIME)
+    return activity
+
+
+def _get_activity():
+    activity = cache.get(_buffer_key())
+    if activity is None:
+        activity = rebuild()
+    return activity
+
+
+def invalidate():
+    """Drop buffer, next read loads it from db
+
+    Writes never patch buffer in place, concurrent saves would
+    overwrite each other.
+    """
+    bump_version(ACTIVITY_CACHE_KEY, ACTIVITY_TIME)
+
+
+def remove(type, id):
+    """Drop buffer if entry is in it"""
+    activity = cache.get(_buffer_key())
+    if activity is not None and filter(
+        lambda entry: entry['id'] == id, activity[type],
+    ):
+        invalidate()
+
+
+def get(type, count=20):
+    """Get count last entries of type"""
+    return _get_activity()[type][:count]
+
+
+def get_merged(count=20):
+    """Get count last posts and comments sorted by date"""
+    activity = _get_activity()
+    return sorted(
+        activity[TYPE_POST][:count] + activity[TYPE_COMMENT][:count],
+        key=lambda entry: entry['date'], reverse=True,
+    )[:count]
+
+
+def on_post_save(instance, created, **kwargs):
+    if created:
+        invalidate()
+    else:
+        remove(TYPE_POST, instance.id)
+
+
+def on_post_delete(instance, **kwargs):
+    remove(TYPE_POST, instance.id)
+
+
+def on_comment_save(instance, created, **kwargs):
+    if instance.depth == 1:
+        return
+    if created:
+        invalidate()
+    else:
+        remove(TYPE_COMMENT, instance.id)
+
+
+def on_comment_delete(instance, **kwargs):
+    remove(TYPE_COMMENT, instance.id)
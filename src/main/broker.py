@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.importlib import import_module
+from threading import Condition
+import time
+
+
+COMMENT_WAIT_TIMEOUT = getattr(settings, 'COMMENT_WAIT_TIMEOUT', 25)
+COMMENT_WAIT_INTERVAL = getattr(settings, 'COMMENT_WAIT_INTERVAL', 1)
+COMMENT_POLL_INTERVAL = getattr(settings, 'COMMENT_POLL_INTERVAL', 10)
+COMMENT_BROKER = getattr(settings, 'COMMENT_BROKER', 'main.broker.CacheBroker')
+
+
+def is_green():
+    """Check process runs with gevent monkey patching, see push.py"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return 'time' in getattr(monkey, 'saved', {})
+
+
+def get_wait_timeout():
+    """Wait only in greenlets, sync workers answer at once"""
+    return COMMENT_WAIT_TIMEOUT if is_green() else 0
+
+
+class LocalBroker(object):
+    """In-process pub/sub of new comment ids per post
+
+    Stand-in for shared broker, sees only comments published by same
+    process. Waiting uses threading primitives, so with gevent monkey
+    patching open connections are greenlets, not workers.
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+        self._last = {}
+
+    def publish(self, post_id, comment_id):
+        """Notify waiters of post about new comment"""
+        with self._condition:
+            self._last[post_id] = max(self._last.get(post_id, 0), comment_id)
+            self._condition.notify_all()
+
+    def last(self, post_id):
+        """Get id of last published comment of post"""
+        return self._last.get(post_id, 0)
+
+    def wait(self, post_id, since, timeout=COMMENT_WAIT_TIMEOUT):
+        """Wait for comment newer than since
+
+        Keyword arguments:
+        post_id -- Integer
+        since -- Integer, last comment id known by reader
+        timeout -- Integer, seconds
+
+        Returns: Integer, id of last comment, since if nothing new
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while self._last.get(post_id, 0) <= since:
+                left = deadline - time.time()
+                if left <= 0:
+                    return since
+                self._condition.wait(left)
+            return self._last[post_id]
+
+
+class CacheBroker(object):
+    """Pub/sub of new comment ids per post through shared cache
+
+    Works across processes, waiters poll cache every
+    COMMENT_WAIT_INTERVAL, with gevent time.sleep only switches greenlet.
+    """
+    key = 'main_comment_broker_%d'
+
+    def publish(self, post_id, comment_id):
+        """Notify waiters of post about new comment"""
+        if comment_id > self.last(post_id):
+            cache.set(self.key % (post_id,), comment_id, COMMENT_WAIT_TIMEOUT * 10)
+
+    def last(self, post_id):
+        """Get id of last published comment of post"""
+        return cache.get(self.key % (post_id,), 0)
+
+    def wait(self, post_id, since, timeout=COMMENT_WAIT_TIMEOUT):
+        """Wait for comment newer than since
+
+        Keyword arguments:
+        post_id -- Integer
+        since -- Integer, last comment id known by reader
+        timeout -- Integer, seconds
+
+        Returns: Integer, id of last comment, since if nothing new
+        """
+        deadline = time.time() + timeout
+        while True:
+            last = self.last(post_id)
+            if last > since:
+                return last
+            if time.time() + COMMENT_WAIT_INTERVAL > deadline:
+                return since
+            time.sleep(COMMENT_WAIT_INTERVAL)
+
+
+def _load_broker():
+    module, name = COMMENT_BROKER.rsplit('.', 1)
+    return getattr(import_module(module), name)()
+
+broker = _load_broker()
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from treebeard.mp_tree import MP_Node
+from treebeard.ns_tree import NS_Node
+
+
+COMMENT_TREE_BACKEND = getattr(settings, 'COMMENT_TREE_BACKEND', 'ns')
+
+
+class NestedSetTree(object):
+    """Comment queries for treebeard nested sets
+
+    Cheap subtree reads, but insert shifts lft/rgt of all later nodes
+    of post tree.
+    """
+
+    @staticmethod
+    def get_last(obj, date):
+        """Get lasts comment
+
+        Last node in preorder of obj subtree created before date, found
+        with one query on nested set columns.
+
+        Keyword arguments:
+        obj -- Comment
+        date -- datetime
+
+        Returns: Comment
+        """
+        try:
+            return type(obj).objects.filter(
+                tree_id=obj.tree_id, lft__gte=obj.lft,
+                lft__lt=obj.rgt, created__lt=date,
+            ).order_by('-lft')[0]
+        except IndexError:
+            return obj
+
+    def get_placceholder(self):
+        """Get comment holder
+
+        Same as get_last for parent, parent bounds taken by subquery.
+        """
+        quote = connection.ops.quote_name
+        table = quote(self._meta.db_table)
+        try:
+            return type(self).objects.filter(
+                tree_id=self.tree_id, lft__lt=self.lft, created__lt=self.created,
+            ).extra(where=[
+                '%s.lft >= (SELECT parent.lft FROM %s parent'
+                ' WHERE parent.tree_id = %%s AND parent.lft < %%s'
+                ' AND parent.rgt > %%s AND parent.depth = %%s)' % (table, table),
+            ], params=[
+                self.tree_id, self.lft, self.rgt, self.depth - 1,
+            ]).order_by('-lft')[0]
+        except IndexError:
+            return self.get_parent()
+
+    @classmethod
+    def get_placeholders(cls, comments):
+        """Get holders ids for list of comments with one query
+
+        Holder of each comment is taken by correlated subquery, so only
+        one row per comment is read however big the thread is.
+
+        Keyword arguments:
+        comments -- list of Comment
+
+        Returns: dict comment id -> holder id
+        """
+        if not comments:
+            return {}
+        table = connection.ops.quote_name(cls._meta.db_table)
+        holder = (
+            'SELECT holder.id FROM %(table)s holder'
+            ' WHERE holder.tree_id = %(table)s.tree_id AND holder.lft < %(table)s.lft'
+            ' AND (holder.created < %(table)s.created'
+            ' OR holder.depth = %(table)s.depth - 1)'
+            ' AND holder.lft >= (SELECT parent.lft FROM %(table)s parent'
+            ' WHERE parent.tree_id = %(table)s.tree_id AND parent.lft < %(table)s.lft'
+            ' AND parent.rgt > %(table)s.rgt AND parent.depth = %(table)s.depth - 1)'
+            ' ORDER BY holder.lft DESC LIMIT 1'
+        ) % {'table': table}
+        return dict(
+            (id, holder or id) for id, holder in cls.objects.filter(
+                id__in=[comment.id for comment in comments],
+            ).extra(select={'holder': holder}).values_list('id', 'holder')
+        )
+
+
+    @classmethod
+    def get_window(cls, root, after, budget):
+        """Get whole top level branches after branch until budget exceeded
+
+        Keyword arguments:
+        root -- Comment, root of post
+        after -- Integer, id of last shown top level comment or None
+        budget -- Integer, max count of nodes, first branch shown anyway
+
+        Returns: (Comment QuerySet, id of last branch or None if no more)
+        """
+        children = root.get_children()
+        if after is not None:
+            children = children.filter(
+                lft__gt=cls.objects.filter(id=after).values_list('rgt', flat=True)[0],
+            )
+        rows = list(children.values_list('id', 'lft', 'rgt')[:budget + 1])
+        size = taken = 0
+        for id, lft, rgt in rows[:budget]:
+            nodes = (rgt - lft + 1) / 2
+            if taken and size + nodes > budget:
+                break
+            size += nodes
+            taken += 1
+        if not taken:
+            return cls.objects.none(), None
+        comments = cls.objects.filter(
+            tree_id=root.tree_id, lft__gte=rows[0][1], rgt__lte=rows[taken - 1][2],
+        ).order_by('lft')
+        return comments, rows[taken - 1][0] if len(rows) > taken else None
+
+
+class PathTree(object):
+    """Comment queries for treebeard materialized path
+
+    Insert of newest comment touches only parent numchild, subtree is
+    path prefix range.
+    """
+
+    @staticmethod
+    def get_last(obj, date):
+        """Get lasts comment
+
+        Keyword arguments:
+        obj -- Comment
+        date -- datetime
+
+        Returns: Comment
+        """
+        try:
+            return type(obj).objects.filter(
+                path__startswith=obj.path, created__lt=date,
+            ).order_by('-path')[0]
+        except IndexError:
+            return obj
+
+    def get_placceholder(self):
+        """Get comment holder"""
+        try:
+            return type(self).objects.filter(
+                path__startswith=self.path[:-self.steplen],
+                path__lt=self.path, created__lt=self.created,
+            ).order_by('-path')[0]
+        except IndexError:
+            return self.get_parent()
+
+    @classmethod
+    def get_placeholders(cls, comments):
+        """Get holders ids for list of comments with one query
+
+        Keyword arguments:
+        comments -- list of Comment
+
+        Returns: dict comment id -> holder id
+        """
+        parents = set(
+            comment.path[:-cls.steplen] for comment in comments
+            if comment.depth > 1
+        )
+        if not parents:
+            return dict((comment.id, comment.id) for comment in comments)
+        query = Q()
+        for path in parents:
+            query |= Q(path__startswith=path)
+        nodes = list(cls.objects.filter(query).values_list('id', 'path', 'created'))
+        result = {}
+        for comment in comments:
+            if comment.depth == 1:
+                result[comment.id] = comment.id
+                continue
+            parent = comment.path[:-cls.steplen]
+            result[comment.id] = max([(path, id) for id, path, created in nodes if (
+                path == parent or (
+                    path.startswith(parent) and path < comment.path
+                    and created < comment.created
+                )
+            )] or [(None, comment.id)])[1]
+        return result
+
+
+    @classmethod
+    def get_window(cls, root, after, budget):
+        """Get whole top level branches after branch until budget exceeded
+
+        Same as NestedSetTree.get_window, branch sizes found by loading
+        budget of nodes in path order.
+        """
+        children = root.get_children()
+        if after is not None:
+            children = children.filter(
+                path__gt=cls.objects.filter(id=after).values_list('path', flat=True)[0],
+            )
+        try:
+            first = children.values_list('path', flat=True)[0]
+        except IndexError:
+            return cls.objects.none(), None
+        nodes = cls.objects.filter(
+            path__startswith=root.path, path__gte=first,
+        ).order_by('path')
+        paths = list(nodes.values_list('path', flat=True)[:budget + 1])
+        branch_len = len(root.path) + cls.steplen
+        if len(paths) > budget:
+            last = paths[-1][:branch_len]
+            paths = [path for path in paths if path[:branch_len] != last]
+        if paths:
+            comments = nodes.filter(path__lte=paths[-1])
+            last = paths[-1][:branch_len]
+        else:
+            comments = nodes.filter(path__startswith=first)
+            last = first
+        if not children.filter(path__gt=last).exists():
+            return comments, None
+        return comments, cls.objects.filter(path=last).values_list('id', flat=True)[0]
+
+
+class AuthorNode(object):
+    """Read-only comment author, shared by all comments of author"""
+    __slots__ = ('id', 'username', 'avatar')
+
+    def __init__(self, id, username, avatar):
+        self.id = id
+        self.username = username
+        self.avatar = avatar
+
+    def __unicode__(self):
+        return self.username
+
+    def get_profile(self):
+        return self
+
+    def get_avatar(self):
+        return self.avatar
+
+
+class CommentRenderNode(object):
+    """Read-only comment for rendering tree"""
+    __slots__ = (
+        'id', 'author', 'text', 'rate', 'rate_count',
+        'created', 'depth', 'is_removed', 'parent_id',
+    )
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def __unicode__(self):
+        return self.text
+
+    def get_depth(self):
+        return self.depth
+
+    def get_margin(self):
+        """Get margin from comment tree"""
+        return (self.depth - 2) * 20
+
+    def get_parent_id(self):
+        return self.parent_id
+
+
+def build_nodes(comments):
+    """Make CommentRenderNode list from comments query in tree order
+
+    Keyword arguments:
+    comments -- Comment QuerySet in preorder
+
+    Returns: list of CommentRenderNode
+    """
+    from main.models import Profile
+    rows = list(comments.values(
+        'id', 'author', 'author__username', 'text', 'rate',
+        'rate_count', 'created', 'depth', 'is_removed',
+    ))
+    avatars = dict(Profile.objects.filter(
+        user__in=set(row['author'] for row in rows if row['author']),
+    ).values_list('user', 'avatar'))
+    authors = {}
+    parents = {}
+    nodes = []
+    for row in rows:
+        author = row['author']
+        if author is not None and author not in authors:
+            authors[author] = AuthorNode(
+                author, row['author__username'],
+                Profile(avatar=avatars.get(author)).get_avatar(),
+            )
+        parents[row['depth']] = row['id']
+        nodes.append(CommentRenderNode(
+            id=row['id'], author=authors.get(author),
+            text=row['text'], rate=row['rate'],
+            rate_count=row['rate_count'], created=row['created'],
+            depth=row['depth'], is_removed=row['is_removed'],
+            parent_id=parents.get(row['depth'] - 1, row['id']),
+        ))
+    return nodes
+
+
+def path_step(num):
+    """Encode step of materialized path same as MP_Node"""
+    alphabet = MP_Node.alphabet
+    key = ''
+    while num:
+        num, rest = divmod(num, len(alphabet))
+        key = alphabet[rest] + key
+    return key.rjust(MP_Node.steplen, '0')
+
+
+def get_node_class():
+    """Get treebeard base class and queries for COMMENT_TREE_BACKEND"""
+    if COMMENT_TREE_BACKEND == 'mp':
+        return MP_Node, PathTree
+    return NS_Node, NestedSetTree
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import signals
+from django.db.models.query import QuerySet
+from django.utils.hashcompat import md5_constructor
+from main.utils import get_version, bump_version
+import re
+
+
+COUNT_MODE = getattr(settings, 'COUNT_MODE', 'cached')
+COUNT_TIME = getattr(settings, 'COUNT_TIME', 60 * 60)
+COUNT_EXACT_THRESHOLD = getattr(settings, 'COUNT_EXACT_THRESHOLD', 10000)
+MODE_EXACT = 'exact'
+MODE_CACHED = 'cached'
+MODE_ESTIMATED = 'estimated'
+
+
+def _version_key(model):
+    return 'main_count_version_%s' % (model._meta.db_table,)
+
+
+def bump(sender, **kwargs):
+    """Make cached counts over sender table stale"""
+    bump_version(_version_key(sender), COUNT_TIME)
+
+
+def watch(*models):
+    """Invalidate cached counts on writes to models"""
+    for model in models:
+        signals.post_save.connect(bump, sender=model)
+        signals.post_delete.connect(bump, sender=model)
+
+
+def exact_count(qs):
+    return QuerySet.count(qs)
+
+
+def cached_count(qs, models):
+    """Count stored by query sql and versions of used tables"""
+    keys = map(_version_key, models)
+    versions = cache.get_many(keys)
+    sql, params = qs.query.get_compiler(qs.db).as_sql()
+    key = 'main_count_%s' % md5_constructor(repr((
+        sql, params, [
+            versions.get(key) or get_version(key, COUNT_TIME) for key in keys
+        ],
+    ))).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = exact_count(qs)
+        cache.set(key, count, COUNT_TIME)
+    return count
+
+
+def estimate_count(qs):
+    """Rows estimate from planner statistics, None if db can't tell"""
+    connection = connections[qs.db]
+    sql, params = qs.query.get_compiler(qs.db).as_sql()
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('EXPLAIN ' + sql, params)
+        match = re.search(r'rows=(\d+)', cursor.fetchone()[0])
+        return match and int(match.group(1))
+    elif connection.vendor == 'mysql':
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return int(cursor.fetchone()[columns.index('rows')] or 0)
+    return None
+
+
+class CountedQuerySet(QuerySet):
+    """QuerySet with count from provider, for paginators calling count()"""
+    count_mode = COUNT_MODE
+    count_models = ()
+
+    def _clone(self, *args, **kwargs):
+        clone = super(CountedQuerySet, self)._clone(*args, **kwargs)
+        clone.count_mode = self.count_mode
+        clone.count_models = self.count_models
+        return clone
+
+    def count(self):
+        if self._result_cache is not None and not self._iter:
+            return len(self._result_cache)
+        if self.count_mode == MODE_ESTIMATED:
+            estimate = estimate_count(self)
+            if estimate is None:
+                return cached_count(self, self.count_models)
+            if estimate < COUNT_EXACT_THRESHOLD:
+                return exact_count(self)
+            return estimate
+        elif self.count_mode == MODE_CACHED:
+            return cached_count(self, self.count_models)
+        return exact_count(self)
+
+
+def counted(qs, mode=None, models=()):
+    """Make queryset counted by provider
+
+    Keyword arguments:
+    qs -- QuerySet
+    mode -- String, MODE_EXACT, MODE_CACHED or MODE_ESTIMATED
+    models -- list of Model, other tables query depends on
+
+    Returns: CountedQuerySet
+    """
+    return qs._clone(
+        klass=CountedQuerySet,
+        count_mode=mode or COUNT_MODE,
+        count_models=(qs.model,) + tuple(models),
+    )
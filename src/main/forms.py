@@ -16,13 +16,13 @@
 import json
 from django import forms
 from django_push.publisher import ping_hub
-from tagging.models import Tag
 from timezones.forms import TimeZoneField
 from tagging_autocomplete.widgets import TagAutocomplete
 from main.models import Comment, Post, Blog, UserInBlog, Notify, Draft, Answer
 from django.conf import settings
 from djang0parser import utils
 from main.utils import ModelFormWithUser, PRETTY_TIMEZONE_CHOICES
+from main import tagstats, tagindex
 from django.utils.translation import ugettext as _
 
 
@@ -100,7 +100,8 @@ class CreatePostForm(BasePostForm):
         inst.preview = utils.parse(inst.preview, settings.VALID_TAGS, settings.VALID_ATTRS)
         inst.text = utils.parse(inst.text, settings.VALID_TAGS, settings.VALID_ATTRS)
         inst = super(CreatePostForm, self).save(commit)
-        Tag.objects.update_tags(inst, inst.raw_tags)
+        tagindex.update_tags(inst, inst.raw_tags)
+        tagstats.invalidate()
         inst.create_comment_root()
         for mention in utils.find_mentions(inst.text):
             Notify.new_mention_notify(mention, post=inst)
@@ -137,7 +138,8 @@ class CreateAnswerForm(BasePostForm):
             Answer.objects.create(
                 post=post, value=answer,
             )
-        Tag.objects.update_tags(post, post.raw_tags)
+        tagindex.update_tags(post, post.raw_tags)
+        tagstats.invalidate()
         post.create_comment_root()
         for mention in utils.find_mentions(post.text):
             Notify.new_mention_notify(mention, post=post)
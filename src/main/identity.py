@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+try:
+    from threading import local
+except ImportError:
+    from django.utils._threading_local import local
+_thread_locals = local()
+
+
+def start():
+    """Start request identity map"""
+    _thread_locals.objects = {}
+
+
+def clear():
+    """Drop request identity map"""
+    _thread_locals.objects = None
+
+
+def _get_objects():
+    return getattr(_thread_locals, 'objects', None)
+
+
+def _value(value):
+    return getattr(value, 'pk', value)
+
+
+def add(obj, field='pk'):
+    """Remember object for current request"""
+    objects = _get_objects()
+    if objects is not None:
+        objects[type(obj), 'pk', obj.pk] = obj
+        if field != 'pk':
+            objects[type(obj), field, obj.serializable_value(field)] = obj
+    return obj
+
+
+def get(model, **lookup):
+    """Get object by one field, query db once per request
+
+    Keyword arguments:
+    model -- Model
+    lookup -- one field=value pair, value can be model instance
+
+    Returns: Model or raise model.DoesNotExist
+    """
+    (field, value), = lookup.items()
+    if field == 'id':
+        field = 'pk'
+    objects = _get_objects()
+    key = (model, field, _value(value))
+    if objects is not None and key in objects:
+        return objects[key]
+    return add(model.objects.get(**{field: value}), field)
+
+
+def get_many(model, values, field='pk'):
+    """Get objects by list of field values with one query
+
+    Keyword arguments:
+    model -- Model
+    values -- list
+    field -- String
+
+    Returns: dict value -> Model
+    """
+    objects = _get_objects() or {}
+    values = map(_value, values)
+    result = {}
+    missing = []
+    for value in values:
+        if (model, field, value) in objects:
+            result[value] = objects[model, field, value]
+        else:
+            missing.append(value)
+    if missing:
+        for obj in model.objects.filter(**{'%s__in' % field: missing}):
+            add(obj, field)
+            result[obj.serializable_value(field)] = obj
+    return result
+
+
+def evict(model, **lookup):
+    """Forget object changed in db by update(), next get loads it again
+
+    Keyword arguments:
+    model -- Model
+    lookup -- one field=value pair, value can be model instance
+
+    Returns: None
+    """
+    objects = _get_objects()
+    if not objects:
+        return
+    (field, value), = lookup.items()
+    if field == 'id':
+        field = 'pk'
+    obj = objects.get((model, field, _value(value)))
+    if obj is not None:
+        for key in [key for key, cached in objects.items() if cached is obj]:
+            del objects[key]
+
+
+def get_profile(user):
+    """Get profile of user"""
+    from main.models import Profile
+    return get(Profile, user=user)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.core.cache import cache
+from main.utils import CacheLog
+import datetime
+import time
+
+
+LAST_VIEW_FLUSH_TIME = getattr(settings, 'LAST_VIEW_FLUSH_TIME', 30)
+LAST_VIEW_TIME = getattr(settings, 'LAST_VIEW_TIME', 24 * 60 * 60)
+LAST_VIEW_KEY = 'main_last_view_%d_%d'
+LOG_KEY = 'main_last_view_log'
+
+_log = CacheLog(LOG_KEY, LAST_VIEW_TIME)
+_last_flush = [time.time()]
+
+
+def get_pending(user_id, post_id):
+    """Get view time stored in cache, shared by all workers"""
+    return cache.get(LAST_VIEW_KEY % (user_id, post_id))
+
+
+def get_pending_many(user_id, post_ids):
+    """Get view times of posts stored in cache
+
+    Returns: dict post_id -> datetime
+    """
+    keys = dict((LAST_VIEW_KEY % (user_id, post_id), post_id) for post_id in post_ids)
+    return dict(
+        (keys[key], date) for key, date in cache.get_many(keys.keys()).items()
+    )
+
+
+def touch(user_id, post_id):
+    """Remember post view, written to db by flush
+
+    View time kept in cache under pair key, pair appended to log so
+    any worker can flush it.
+
+    Keyword arguments:
+    user_id -- Integer
+    post_id -- Integer
+
+    Returns: None
+    """
+    cache.set(LAST_VIEW_KEY % (user_id, post_id), datetime.datetime.now(), LAST_VIEW_TIME)
+    _log.append((user_id, post_id))
+    if time.time() - _last_flush[0] > LAST_VIEW_FLUSH_TIME:
+        flush()
+
+
+def _write(pairs):
+    from main.models import LastView
+    keys = dict((LAST_VIEW_KEY % pair, pair) for pair in set(pairs))
+    for key, date in cache.get_many(keys.keys()).items():
+        user_id, post_id = keys[key]
+        if not LastView.objects.filter(
+            user=user_id, post=post_id,
+        ).update(date=date):
+            view = LastView.objects.create(user_id=user_id, post_id=post_id)
+            # date is auto_now, create stores flush time
+            LastView.objects.filter(id=view.id).update(date=date)
+
+
+def flush():
+    """Write views logged since last flush, each pair gets own time"""
+    _last_flush[0] = time.time()
+    _log.flush(_write, LAST_VIEW_FLUSH_TIME)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.core.cache import cache
+from baseutils.jrpc import to_json
+from main.utils import get_version, bump_version
+
+
+LEADERBOARD_SIZE = getattr(settings, 'LEADERBOARD_SIZE', 100)
+LEADERBOARD_TIME = getattr(settings, 'LEADERBOARD_TIME', 60 * 60)
+
+
+class Leaderboard(object):
+    """Bounded top-K list of objects stored in cache
+
+    Entries are (-score, id, data) tuples sorted ascending, exhaustive
+    board holds whole table. Board stored under version token from key,
+    writes never patch it, they drop it by new version when changed
+    object is on board or may enter it, next read loads it from db.
+    """
+
+    def __init__(self, name, get_queryset, get_score, serialize, size=LEADERBOARD_SIZE):
+        self.key = 'main_leaderboard_%s' % (name,)
+        self.get_queryset = get_queryset
+        self.get_score = get_score
+        self.serialize = serialize
+        self.size = size
+
+    def _entry(self, obj):
+        return -self.get_score(obj), obj.id, self.serialize(obj)
+
+    def _board_key(self):
+        return '%s_%s' % (self.key, get_version(self.key, LEADERBOARD_TIME))
+
+    def rebuild(self):
+        """Load top from db"""
+        entries = map(self._entry, self.get_queryset()[:self.size + 1])
+        board = {
+            'entries': entries[:self.size],
+            'exhaustive': len(entries) <= self.size,
+        }
+        cache.set(self._board_key(), board, LEADERBOARD_TIME)
+        return board
+
+    def _get_board(self):
+        board = cache.get(self._board_key())
+        if board is None:
+            board = self.rebuild()
+        return board
+
+    def invalidate(self):
+        """Drop board, next read loads it from db"""
+        bump_version(self.key, LEADERBOARD_TIME)
+
+    def update(self, obj):
+        """Drop board if object score change can move it
+
+        Keyword arguments:
+        obj -- Model
+
+        Returns: None
+        """
+        board = cache.get(self._board_key())
+        if board is None:
+            return
+        entries = board['entries']
+        if board['exhaustive'] or filter(lambda entry: entry[1] == obj.id, entries)\
+                or (entries and (-self.get_score(obj), obj.id) < entries[-1][:2]):
+            self.invalidate()
+
+    def remove(self, obj):
+        """Drop board if deleted object is on it"""
+        board = cache.get(self._board_key())
+        if board is not None and filter(
+            lambda entry: entry[1] == obj.id, board['entries'],
+        ):
+            self.invalidate()
+
+    def get(self, count):
+        """Get data of count top objects"""
+        return [data for score, id, data in self._get_board()['entries'][:count]]
+
+
+def _profiles():
+    from main.models import Profile
+    return Profile.objects.select_related('user').order_by('-fullrate', 'id')
+
+
+def _serialize_profile(profile):
+    return {
+        'json': to_json(profile),
+        'username': profile.user.username,
+        'fullrate': profile.get_rate(),
+    }
+
+
+def _blogs():
+    from main.models import Blog
+    return Blog.objects.order_by('-rate', 'id')
+
+
+def _serialize_blog(blog):
+    return {
+        'json': to_json(blog),
+        'id': blog.id,
+        'name': blog.name,
+        'rate': blog.rate,
+    }
+
+
+users = Leaderboard(
+    'users', _profiles, lambda profile: profile.get_rate(), _serialize_profile,
+)
+blogs = Leaderboard(
+    'blogs', _blogs, lambda blog: blog.rate, _serialize_blog,
+)
+
+
+def update_user(user):
+    """Update users leaderboard after user rate changed"""
+    users.update(_profiles().get(user=user))
+
+
+def rebuild():
+    """Rebuild all leaderboards from db"""
+    users.rebuild()
+    blogs.rebuild()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from treebeard.mp_tree import MP_Node
+from treebeard.ns_tree import NS_Node
+import datetime
+import random
+import time
+
+
+class BenchNestedSet(NS_Node):
+    created = models.DateTimeField()
+
+    class Meta:
+        app_label = 'main'
+        db_table = 'main_bench_comment_ns'
+
+
+class BenchPath(MP_Node):
+    steplen = 4
+    created = models.DateTimeField()
+
+    class Meta:
+        app_label = 'main'
+        db_table = 'main_bench_comment_mp'
+
+
+TREES = (('ns', BenchNestedSet), ('mp', BenchPath))
+
+
+class Command(BaseCommand):
+    help = "Compare comment insert and subtree read of nested set and "\
+        "materialized path trees on scratch tables, dropped after run"
+    args = '[size size ...]'
+
+    def _create(self, cursor, model):
+        statements, references = connection.creation.sql_create_model(model, no_style())
+        for sql in statements + connection.creation.sql_indexes_for_model(model, no_style()):
+            cursor.execute(sql)
+
+    def _bench(self, model, size):
+        start = datetime.datetime.now()
+        root = model.add_root(created=start)
+        ids = [root.id]
+        insert = 0
+        for num in xrange(size):
+            parent = model.objects.get(id=random.choice(ids))
+            begin = time.time()
+            node = parent.add_child(
+                created=start + datetime.timedelta(seconds=num + 1),
+            )
+            insert += time.time() - begin
+            ids.append(node.id)
+        root = model.objects.get(id=root.id)
+        begin = time.time()
+        for num in xrange(10):
+            list(root.get_descendants())
+        read = (time.time() - begin) / 10
+        return insert / size, read
+
+    @transaction.commit_manually
+    def handle(self, *sizes, **options):
+        cursor = connection.cursor()
+        try:
+            for name, model in TREES:
+                self._create(cursor, model)
+            transaction.commit()
+            for size in map(int, sizes or (100, 1000, 10000)):
+                for name, model in TREES:
+                    random.seed(size)
+                    insert, read = self._bench(model, size)
+                    print '%s %d comments: insert %.2f ms, subtree read %.2f ms' % (
+                        name, size, insert * 1000, read * 1000,
+                    )
+                    transaction.rollback()
+        finally:
+            transaction.rollback()
+            for name, model in TREES:
+                cursor.execute('DROP TABLE %s' % (
+                    connection.ops.quote_name(model._meta.db_table),
+                ))
+            transaction.commit()
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from main import related
+
+
+class Command(BaseCommand):
+    help = "Rebuild tf-idf index and related posts table, needs numpy and scipy"
+    args = '[processes]'
+
+    def handle(self, processes=None, **options):
+        processes = processes and int(processes)
+        print 'link %d posts' % related.build(processes)
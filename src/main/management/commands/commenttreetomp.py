@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from main.commenttree import path_step
+from main.models import Comment
+import re
+
+
+# not filled by path backend, so inserts need them nullable
+NS_COLUMNS = ('lft', 'rgt', 'tree_id')
+
+
+class Command(BaseCommand):
+    help = "Fill materialized path columns of comments from nested sets, "\
+        "run before switching COMMENT_TREE_BACKEND to 'mp'"
+
+    def _make_nullable(self, cursor):
+        quote = connection.ops.quote_name
+        db_table = Comment._meta.db_table
+        table = quote(db_table)
+        if connection.vendor == 'postgresql':
+            for column in NS_COLUMNS:
+                cursor.execute('ALTER TABLE %s ALTER COLUMN %s DROP NOT NULL' % (
+                    table, quote(column),
+                ))
+        elif connection.vendor == 'mysql':
+            for column in NS_COLUMNS:
+                cursor.execute('ALTER TABLE %s MODIFY %s %s NULL' % (
+                    table, quote(column),
+                    connection.creation.data_types['PositiveIntegerField'],
+                ))
+        elif connection.vendor == 'sqlite':
+            # sqlite can't alter columns, table copied with changed schema
+            cursor.execute(
+                'SELECT type, sql FROM sqlite_master'
+                ' WHERE tbl_name = %s AND sql IS NOT NULL', [db_table],
+            )
+            schema = cursor.fetchall()
+            create = [sql for type, sql in schema if type == 'table'][0]
+            for column in NS_COLUMNS:
+                create = re.sub(r'(%s [^,]*?) NOT NULL' % re.escape(quote(column)), r'\1', create)
+            old = quote(db_table + '_old')
+            cursor.execute('PRAGMA legacy_alter_table = ON')
+            cursor.execute('ALTER TABLE %s RENAME TO %s' % (table, old))
+            cursor.execute(create)
+            cursor.execute('INSERT INTO %s SELECT * FROM %s' % (table, old))
+            cursor.execute('DROP TABLE %s' % old)
+            for type, sql in schema:
+                if type == 'index':
+                    cursor.execute(sql)
+
+    @transaction.commit_on_success
+    def handle(self, **options):
+        cursor = connection.cursor()
+        table = connection.ops.quote_name(Comment._meta.db_table)
+        columns = [
+            column.name for column in
+            connection.introspection.get_table_description(cursor, Comment._meta.db_table)
+        ]
+        if 'path' not in columns:
+            cursor.execute('ALTER TABLE %s ADD COLUMN path varchar(255)' % table)
+        if 'numchild' not in columns:
+            cursor.execute('ALTER TABLE %s ADD COLUMN numchild integer' % table)
+        self._make_nullable(cursor)
+        cursor.execute(
+            'SELECT id, lft, rgt FROM %s ORDER BY tree_id, lft' % table
+        )
+        nodes = []
+        stack = []
+        roots = 0
+        for id, lft, rgt in cursor.fetchall():
+            while stack and stack[-1]['rgt'] < lft:
+                stack.pop()
+            if stack:
+                parent = stack[-1]
+                parent['numchild'] += 1
+                path = parent['path'] + path_step(parent['numchild'])
+            else:
+                roots += 1
+                path = path_step(roots)
+            node = {'id': id, 'rgt': rgt, 'path': path, 'numchild': 0}
+            nodes.append(node)
+            stack.append(node)
+        cursor.executemany(
+            'UPDATE %s SET path = %%s, numchild = %%s WHERE id = %%s' % table,
+            [(node['path'], node['numchild'], node['id']) for node in nodes],
+        )
+        if 'path' not in columns:
+            cursor.execute(
+                'CREATE UNIQUE INDEX main_comment_path ON %s (path)' % table
+            )
+        print 'fix %d comments' % len(nodes)
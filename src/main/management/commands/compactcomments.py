@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from main.models import Comment
+import time
+
+
+class Command(BaseCommand):
+    help = "Purge removed comments without visible replies in small batches"
+    args = '[batch size] [pause seconds]'
+
+    @transaction.commit_on_success
+    def _purge(self, ids):
+        purged = 0
+        for id in ids:
+            # tree values of loaded nodes get stale after each delete
+            try:
+                comment = Comment.objects.get(id=id, is_removed=True)
+            except Comment.DoesNotExist:
+                continue
+            if not comment.get_descendants().filter(is_removed=False).exists():
+                purged += 1 + comment.get_descendant_count()
+                comment.delete()
+        return purged
+
+    def handle(self, size=100, pause=1, **options):
+        size, pause = int(size), float(pause)
+        ids = list(Comment.objects.filter(
+            is_removed=True,
+        ).order_by('-depth').values_list('id', flat=True))
+        purged = 0
+        for start in xrange(0, len(ids), size):
+            purged += self._purge(ids[start:start + size])
+            time.sleep(pause)
+        print 'purge %d comments' % purged
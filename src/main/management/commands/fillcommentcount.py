@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from main.models import Post
+
+
+class Command(BaseCommand):
+    help = "Recalculate stored Post.comment_count from comments tree"
+
+    def handle(self, **options):
+        print 'fix %d posts' % Post.update_comment_count()
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from main.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Recalculate stored Profile.fullrate from rate fields"
+
+    def handle(self, **options):
+        print 'fix %d profiles' % Profile.update_fullrate()
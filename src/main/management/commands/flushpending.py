@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from main import lastviews, presence
+
+
+class Command(BaseCommand):
+    help = "Write post views and visits buffered in cache to db, run from cron"
+
+    def handle(self, **options):
+        lastviews.flush()
+        presence.flush()
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from main.models import LentaLastView
+
+
+class Command(BaseCommand):
+    help = "Recount cached unseen lenta counters from db"
+
+    def handle(self, **options):
+        print 'fix %d counters' % LentaLastView.reconcile()
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from main import leaderboard
+
+
+class Command(BaseCommand):
+    help = "Rebuild top users and blogs leaderboards from db"
+
+    def handle(self, **options):
+        leaderboard.rebuild()
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from main import timelines
+
+
+class Command(BaseCommand):
+    help = "Fill precomputed post timelines from posts table"
+
+    def handle(self, **options):
+        print 'put %d posts' % timelines.rebuild()
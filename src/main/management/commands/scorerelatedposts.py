@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from main import related
+
+
+class Command(BaseCommand):
+    help = "Find related posts of posts created after last build, run from cron"
+
+    def handle(self, **options):
+        scored = related.score_new()
+        if scored is None:
+            print 'index not built, run buildrelatedposts'
+        else:
+            print 'score %d posts' % scored
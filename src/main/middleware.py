@@ -1,4 +1,5 @@
 from django.shortcuts import render_to_response
+from main import identity
 
 
 class BansMiddleware(object):
@@ -15,4 +16,20 @@ class BansMiddleware(object):
                     'user': request.user,
                     'block': block,
                 })
-        
+
+
+class IdentityMapMiddleware(object):
+    """
+    Middleware that scopes main.identity map to request,
+    must be placed before middlewares using profiles.
+    """
+
+    def process_request(self, request):
+        identity.start()
+
+    def process_response(self, request, response):
+        identity.clear()
+        return response
+
+    def process_exception(self, request, exception):
+        identity.clear()
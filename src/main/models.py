@@ -15,9 +15,9 @@
 #       MA 02110-1301, USA.
 from django_push.publisher import ping_hub
 
-from treebeard.ns_tree import NS_Node
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, Group, Permission
 from django.db import models
+from django.core.cache import cache
 import tagging
 from tagging.fields import TagField
 from tagging.models import Tag
@@ -26,20 +26,27 @@ from main.utils import new_notify_email
 from settings import TIME_ZONE, VALID_TAGS, VALID_ATTRS, NEWPOST_RATE, NEWBLOG_RATE, NEWCOMMENT_RATE, RATEPOST_RATE, DEFAULT_AVATAR, PUSH_HUB, FEED_URL, RATEBLOG_RATE
 from settings import RATECOM_RATE, RATEUSER_RATE, POST_RATE_COEFFICIENT, BLOG_RATE_COEFFICIENT, COMMENT_RATE_COEFFICIENT, PUBSUB, ONLINE_TIME
 from settings import DEFAULT_BLOG_TYPE
+from django.conf import settings
 from utils import file_upload_path, Access, get_status, new_notify_email
+from main import presence, leaderboard, activity, identity, treecache, lastviews, commenttree, counts
+from main import timelines, tagindex
+from tools.mixins import removable_from
 from djang0parser import utils
 from django.utils.translation import gettext as _
 from urlparse import urlparse
 import datetime
 from django.db.models import Q
+from django.db import connection
+from django.db.backends.util import typecast_timestamp
+from django.utils.datastructures import SortedDict
 from baseutils.jrpc import to_json
 
 
 def get_profile(self):  # need hard refactoring!!!
     try:
-        return Profile.objects.get(user=self)
-    except User.DoesNotExist:
-        return Profile.objects.create(user=self)
+        return identity.get_profile(self)
+    except Profile.DoesNotExist:
+        return identity.add(Profile.objects.create(user=self), 'user')
 User.get_profile = get_profile
 
 
@@ -143,8 +150,11 @@ class Blog(models.Model):
             Profile.objects.filter(
                 user=self.owner
             ).update(
-                blogs_rate=models.F('blogs_rate') + value
+                blogs_rate=models.F('blogs_rate') + value,
+                fullrate=models.F('fullrate') + value * BLOG_RATE_COEFFICIENT,
             )
+            identity.evict(Profile, user=self.owner)
+            leaderboard.update_user(self.owner)
             return True
                 
     def add_or_remove_user(self, user):
@@ -173,6 +183,11 @@ class Blog(models.Model):
     def get_rates(self):
         return BlogRate.objects.select_related('user').filter(blog=self)
 
+    def save(self, *args, **kwargs):
+        """Save and update leaderboard"""
+        super(Blog, self).save(*args, **kwargs)
+        leaderboard.blogs.update(self)
+
     @staticmethod
     def create_list(profile, selected = None, append=None):
         blogs = [uib.blog for uib in profile.get_blogs()]
@@ -303,6 +318,7 @@ class Post(Draft):
     pinch = models.BooleanField(default=False, verbose_name=_('Pinch post'))
     solved = models.BooleanField(default=False, verbose_name=_('Is solved'))
     right_answer = models.ForeignKey('Comment', blank=True, null=True, related_name='right_answer', verbose_name=_('Right answer'))
+    comment_count = models.IntegerField(default=0, editable=False, verbose_name=_('Count of comments'))
 
     class Meta:
         ordering = ('-id', )
@@ -338,11 +354,83 @@ class Post(Draft):
         except IndexError:
             return None
 
+    def get_comment_window(self, after=None, budget=None):
+        """Return window of comments tree with whole top level branches
+
+        Keyword arguments:
+        after -- Integer, id of last shown top level comment
+        budget -- Integer, COMMENT_WINDOW_SIZE by default
+
+        Returns: (list of commenttree.CommentRenderNode, id of last shown branch or None),
+        raise Comment.DoesNotExist if after is not top level comment of post
+        """
+        if after is not None and not Comment.objects.filter(
+            id=after, post=self, depth=2,
+        ).exists():
+            raise Comment.DoesNotExist
+        try:
+            root = Comment.objects.filter(post=self, depth=1)[0]
+        except IndexError:
+            return [], None
+        comments, last = Comment.get_window(
+            root, after, budget or getattr(settings, 'COMMENT_WINDOW_SIZE', 200),
+        )
+        return commenttree.build_nodes(comments), last
+
 
     def create_comment_root(self):
         """Create comment root for post"""
         comment_root = Comment.add_root(post=self, created=datetime.datetime.now())
         return comment_root
+
+    @staticmethod
+    def update_comment_count(qs=None):
+        """Recalculate stored comment_count
+
+        Keyword arguments:
+        qs -- Post QuerySet, all posts by default
+
+        Returns: Integer
+        """
+        if qs is None:
+            qs = Post.objects.all()
+        counts = dict(Comment.objects.filter(
+            post__in=qs, depth__gt=1, is_removed=False,
+        ).values_list('post').annotate(count=models.Count('id')))
+        by_count = {}
+        for post_id in qs.values_list('id', flat=True):
+            by_count.setdefault(counts.get(post_id, 0), []).append(post_id)
+        for count, ids in by_count.items():
+            Post.objects.filter(id__in=ids).update(comment_count=count)
+        return sum(map(len, by_count.values()))
+
+    @staticmethod
+    def get_new_comment_counts(posts, user):
+        """Count comments added after user last view for page of posts
+
+        Keyword arguments:
+        posts -- list of Post
+        user -- User
+
+        Returns: dict post_id -> Integer, -1 for anonymous
+        """
+        if not user.is_authenticated():
+            return dict((post.id, -1) for post in posts)
+        result = dict((post.id, post.comment_count) for post in posts)
+        views = dict(LastView.objects.filter(
+            post__in=result.keys(), user=user,
+        ).values_list('post', 'date'))
+        # views not flushed yet are newer than db ones
+        views.update(lastviews.get_pending_many(user.id, result.keys()))
+        if views:
+            query = Q()
+            for post_id, date in views.items():
+                query |= Q(post=post_id, created__gt=date)
+                result[post_id] = 0
+            result.update(Comment.objects.filter(query).filter(
+                depth__gt=1, is_removed=False,
+            ).values_list('post').annotate(count=models.Count('id')))
+        return result
         
     def _get_content(self, type=0):
         """Return post content, 0 - preview, 1 - post
@@ -406,8 +494,11 @@ class Post(Draft):
             Profile.objects.filter(
                 user=self.author
             ).update(
-                posts_rate=models.F('posts_rate') + value
+                posts_rate=models.F('posts_rate') + value,
+                fullrate=models.F('fullrate') + value * POST_RATE_COEFFICIENT,
             )
+            identity.evict(Profile, user=self.author)
+            leaderboard.update_user(self.author)
             return True
             
     def get_tags(self):
@@ -418,7 +509,7 @@ class Post(Draft):
         """Check post type is answer and return questions
 
         Keyword arguments:
-        user -- request.user
+        user -- request.user, vote taken from viewer state if loaded
 
         Returns: Array/Boolean
 
@@ -440,7 +531,9 @@ class Post(Draft):
                     'width': action(answ.count),
                     'id': answ.id
                 } for answ in answer]
-                if user is not None:
+                if user is not None and hasattr(self, 'viewer_voted'):
+                    self.is_result = user.is_authenticated() and not self.viewer_voted
+                elif user is not None:
                     self.is_result = user.is_authenticated() and not Answer.check(self, user)
                 return self._is_answer
             except (Answer.DoesNotExist, IndexError):
@@ -448,6 +541,56 @@ class Post(Draft):
                 self.is_result = False
                 return False
 
+    @staticmethod
+    def get_with_viewer_state(id, user):
+        """Get post with state of viewer loaded by same query
+
+        Sets viewer_favourite, viewer_spy, viewer_voted and
+        viewer_last_view attributes for authenticated user.
+
+        Keyword arguments:
+        id -- Integer
+        user -- User
+
+        Returns: Post or raise Post.DoesNotExist
+        """
+        posts = Post.objects.select_related(
+            'author', 'blog', 'blog__type', 'right_answer',
+        )
+        if not user.is_authenticated():
+            return posts.get(id=id)
+        quote = connection.ops.quote_name
+        post_id = '%s.%s' % (
+            quote(Post._meta.db_table), quote(Post._meta.pk.column),
+        )
+        subquery = 'SELECT %s(%s) FROM %s WHERE %s = ' + post_id + ' AND %s = %%s'
+        select = {}
+        for name, model, aggregate, field in (
+            ('viewer_favourite', Favourite, 'COUNT', 'id'),
+            ('viewer_spy', Spy, 'COUNT', 'id'),
+            ('viewer_voted', AnswerVote, 'COUNT', 'id'),
+            ('viewer_last_view', LastView, 'MAX', 'date'),
+        ):
+            opts = model._meta
+            select[name] = subquery % (
+                aggregate, quote(opts.get_field(field).column),
+                quote(opts.db_table),
+                quote(opts.get_field(
+                    'answer' if model is AnswerVote else 'post'
+                ).column),
+                quote(opts.get_field('user').column),
+            )
+        names = sorted(select)
+        post = posts.extra(
+            select=SortedDict((name, select[name]) for name in names),
+            select_params=[user.id] * len(names),
+        ).get(id=id)
+        last_view = post.viewer_last_view
+        if isinstance(last_view, basestring):
+            last_view = typecast_timestamp(last_view)
+        post.viewer_last_view = last_view
+        return post
+
     def have_cut(self):
         """Check if 'cut' exsisted"""
         return self.text != self.preview
@@ -464,8 +607,14 @@ class Post(Draft):
         verbose_name_plural = _("Posts")
  
     
-class Comment(NS_Node):
-    """Comments table"""
+CommentNode, CommentTree = commenttree.get_node_class()
+
+
+class Comment(CommentTree, removable_from(CommentNode)):
+    """Comments table, tree storage selected by COMMENT_TREE_BACKEND
+
+    Removed comments stay in tree as tombstones until compactcomments.
+    """
     json_fields = [
         ('post', 'post__json'), 'text',
         ('author', 'author__json'), 'rate',
@@ -500,27 +649,21 @@ class Comment(NS_Node):
         """Get margin from comment tree"""
         return (self.depth - 2) * 20
 
-    @staticmethod
-    def get_last(obj, date):
-        """Get lasts comment
-
-        Keyword arguments:
-        obj -- Comment
-        date -- datetime
-
-        Returns: Comment QuerySet
-        """
-        while True:
-            try:
-                obj = obj.get_children().filter(created__lt=date).order_by('-created')[0]
-            except IndexError:
-                return obj
-
+    def remove(self):
+        """Tombstone comment without touching tree"""
+        super(Comment, self).remove()
+        Post.objects.filter(id=self.post_id).update(
+            comment_count=models.F('comment_count') - 1,
+        )
+        activity.remove(activity.TYPE_COMMENT, self.id)
 
-    def get_placceholder(self):
-        """Get comment holder"""
-        return Comment.get_last(self.get_parent(), self.created)
-        #return self.get_parent()
+    def restore(self):
+        """Bring tombstoned comment back"""
+        super(Comment, self).restore()
+        Post.objects.filter(id=self.post_id).update(
+            comment_count=models.F('comment_count') + 1,
+        )
+        activity.invalidate()
 
     def get_parent_id(self):
         """Get parent comment id"""
@@ -552,8 +695,11 @@ class Comment(NS_Node):
             Profile.objects.filter(
                 user=self.author
             ).update(
-                comments_rate=models.F('comments_rate') + value
+                comments_rate=models.F('comments_rate') + value,
+                fullrate=models.F('fullrate') + value * COMMENT_RATE_COEFFICIENT,
             )
+            identity.evict(Profile, user=self.author)
+            leaderboard.update_user(self.author)
             self.save()
             return True
 
@@ -566,7 +712,7 @@ class Comment(NS_Node):
 
     @property
     def author__json(self):
-        return to_json(self.authr)
+        return to_json(self.author)
 
     class Meta:
         ordering = ['id']
@@ -617,6 +763,7 @@ class Profile(models.Model):
     posts_rate = models.IntegerField(default=0, verbose_name=_('Rate earned by posts'))
     comments_rate = models.IntegerField(default=0, verbose_name=_('Rate earned by comments'))
     blogs_rate = models.IntegerField(default=0, verbose_name=_('Rate earned by blogs'))
+    fullrate = models.FloatField(default=0, db_index=True, editable=False, verbose_name=_('Full rate'))
     timezone = TimeZoneField(default=TIME_ZONE, verbose_name=_('Timezone'))
     avatar = models.ImageField(upload_to=file_upload_path, blank=True, null=True, verbose_name=_('User picture'))
     hide_mail = models.BooleanField(default=True, verbose_name=_('Show email?'))
@@ -662,11 +809,19 @@ class Profile(models.Model):
         if not UserRate.objects.filter(user=self).count():
             self.rate += value
             self.rate_count += 1
+            self.fullrate += value
             rate = UserRate.objects.create(
                 profile=self,
                 user=user,
                 negative=(value == -1)
             )
+            Profile.objects.filter(id=self.id).update(
+                rate=models.F('rate') + value,
+                rate_count=models.F('rate_count') + 1,
+                fullrate=models.F('fullrate') + value,
+            )
+            identity.evict(Profile, id=self.id)
+            leaderboard.update_user(self.user)
             return True
         else:
             return False
@@ -677,32 +832,56 @@ class Profile(models.Model):
                + self.blogs_rate * BLOG_RATE_COEFFICIENT
                + self.comments_rate * COMMENT_RATE_COEFFICIENT)
 
+    @staticmethod
+    def update_fullrate(qs=None):
+        """Recalculate stored fullrate
+
+        Keyword arguments:
+        qs -- Profile QuerySet, all profiles by default
+
+        Returns: Integer
+        """
+        if qs is None:
+            qs = Profile.objects.all()
+        return qs.update(
+            fullrate=models.F('rate')
+            + models.F('posts_rate') * POST_RATE_COEFFICIENT
+            + models.F('blogs_rate') * BLOG_RATE_COEFFICIENT
+            + models.F('comments_rate') * COMMENT_RATE_COEFFICIENT
+        )
+
+    def save(self, *args, **kwargs):
+        """Store fullrate, save and update leaderboard"""
+        self.fullrate = self.get_rate()
+        super(Profile, self).save(*args, **kwargs)
+        leaderboard.users.update(self)
+
+    def get_capabilities(self):
+        """Get cached bitmask of access and permissions
+
+        Cached mask recompiled when rate crosses one of thresholds.
+
+        Returns: Integer
+        """
+        rate = self.get_rate()
+        level = Access.get_level(rate)
+        key = Access.cache_key(self.user_id)
+        cached = cache.get(key)
+        if cached is None or cached[0] != level:
+            cached = (level, Access.compile(rate, self.user))
+            cache.set(key, cached, Access.CAPABILITIES_TIME)
+        return cached[1]
+
     def check_access(self, type):
         """Check user access
 
         Keyword arguments:
-        type -- Access:
+        type -- Access or permission name from Access.PERMISSIONS
 
         Returns: Boolean
 
         """
-        rate = self.get_rate()
-        if type == Access.new_blog and rate >= NEWBLOG_RATE:
-            return True
-        elif type == Access.new_comment and rate >= NEWCOMMENT_RATE:
-            return True
-        elif type == Access.new_post and rate >= NEWPOST_RATE:
-            return True
-        elif type == Access.rate_comment and rate >= RATECOM_RATE:
-            return True
-        elif type == Access.rate_blog and rate >= RATEBLOG_RATE:
-            return True
-        elif type == Access.rate_post and rate >= RATEPOST_RATE:
-            return True
-        elif type == Access.rate_user and rate >= RATEUSER_RATE:
-            return True
-        else:
-            return False
+        return bool(self.get_capabilities() & Access.bit(type))
 
     def post_count(self):
         """Return post count"""
@@ -710,7 +889,7 @@ class Profile(models.Model):
 
     def comment_count(self):
         """Return comment count"""
-        return int(Comment.objects.filter(author=self.user).count())
+        return int(Comment.objects.filter(author=self.user, is_removed=False).count())
 
     def get_avatar(self):
         """Get url of user avatar"""
@@ -786,25 +965,12 @@ class Profile(models.Model):
         return is_my_friend
 
     def update_last_visit(self):
-        """Update last site visit time"""
-        try:
-            view = LastVisit.objects.get(user=self.user)
-            view.date = datetime.datetime.now()
-            view.save()
-        except LastVisit.DoesNotExist:
-            view = LastVisit(user=self.user)
-            view.save()
+        """Update last site visit time, LastVisit written in batches"""
+        presence.touch(self.user)
 
     def is_online(self):
         """Check online status"""
-        try:
-            LastVisit.objects.get(
-                user=self.user,
-                date__gt=datetime.datetime.now() - datetime.timedelta(seconds=ONLINE_TIME)
-            )
-            return True
-        except LastVisit.DoesNotExist:
-            return False
+        return presence.is_online(self.user)
 
     def get_block(self):
         """Get bans and blocks"""
@@ -1032,6 +1198,7 @@ class Notify(models.Model):
         else:
             self.comment = alien
         self.save()
+        LentaLastView.increment(user)
         return self
             
     @staticmethod
@@ -1125,6 +1292,7 @@ class Notify(models.Model):
                 else:
                     notify = Notify(comment=comment, user=usr)
                 notify.save()
+                LentaLastView.increment(usr)
                 return True
         except User.DoesNotExist:
             pass
@@ -1277,6 +1445,53 @@ class LastView(models.Model):
         self.date = datetime.datetime.now()
         self.save()
 
+    @staticmethod
+    def touch(user, post):
+        """Get previous view time and mark post viewed now
+
+        View written to db later in batch by lastviews.flush.
+
+        Keyword arguments:
+        user -- User
+        post -- Post
+
+        Returns: datetime or None if post not viewed before
+        """
+        date = lastviews.get_pending(user.id, post.id)
+        if date is None and hasattr(post, 'viewer_last_view'):
+            date = post.viewer_last_view
+        elif date is None:
+            date = LastView.objects.filter(
+                user=user, post=post,
+            ).aggregate(models.Max('date'))['date__max']
+        lastviews.touch(user.id, post.id)
+        return date
+
+class Timeline(models.Model):
+    """Precomputed post lists, maintained by main.timelines"""
+    name = models.CharField(max_length=50, db_index=True)
+    post = models.ForeignKey(Post)
+    pinch = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = (('name', 'post'), ('name', 'pinch', 'post'))
+
+    def __unicode__(self):
+        return self.name
+
+class RelatedPost(models.Model):
+    """Precomputed similar posts, filled by main.related"""
+    post = models.ForeignKey(Post, related_name='related_set')
+    related = models.ForeignKey(Post, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('post', 'related')
+        ordering = ('-score',)
+
+    def __unicode__(self):
+        return u'%d: %d' % (self.post_id, self.related_id)
+
 class LastVisit(models.Model):
     """User visit time model"""
     date = models.DateTimeField(auto_now=True)
@@ -1289,11 +1504,9 @@ class LastVisit(models.Model):
         Keyword arguments:
         time -- Integer
 
-        Returns: LastVisit QuerySet        
+        Returns: list of usernames
         """
-        return LastVisit.objects.filter(
-            date__gt=datetime.datetime.now() - datetime.timedelta(seconds=time)
-        ).select_related('user')
+        return presence.get_online(time)
 
     def __unicode__(self):
         return self.user.username
@@ -1303,6 +1516,7 @@ class LastVisit(models.Model):
 
 class LentaLastView(models.Model):
     """Last view of lenta time model"""
+    COUNTER_TIME = getattr(settings, 'LENTA_COUNTER_TIME', 24 * 60 * 60)
 
     date = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User)
@@ -1314,6 +1528,55 @@ class LentaLastView(models.Model):
             user=self.user,
         ).count()
 
+    @staticmethod
+    def _counter_key(user_id):
+        return 'main_lenta_unseen_%d' % (user_id,)
+
+    @classmethod
+    def get_count(cls, user):
+        """Get cached count of unseen entries, count from db on miss
+
+        Keyword arguments:
+        user -- User
+
+        Returns: Integer
+        """
+        count = cache.get(cls._counter_key(user.id))
+        if count is None:
+            try:
+                count = cls.objects.get(user=user).get_unseen_count()
+            except cls.DoesNotExist:
+                count = 0
+            cache.set(cls._counter_key(user.id), count, cls.COUNTER_TIME)
+        return count
+
+    @classmethod
+    def increment(cls, user):
+        """Increment cached unseen counter"""
+        try:
+            cache.incr(cls._counter_key(user.id))
+        except ValueError:
+            pass  # not cached, will be counted from db
+
+    @classmethod
+    def reconcile(cls):
+        """Recount all cached counters with one query
+
+        Returns: Integer
+        """
+        counts = dict(Notify.objects.filter(
+            Q(post__date__gt=models.F('user__lentalastview__date'))
+            | Q(comment__created__gt=models.F('user__lentalastview__date')),
+        ).values_list('user').annotate(count=models.Count('id')))
+        user_ids = cls.objects.values_list('user', flat=True)
+        for user_id in user_ids:
+            cache.set(
+                cls._counter_key(user_id),
+                counts.get(user_id, 0),
+                cls.COUNTER_TIME,
+            )
+        return len(user_ids)
+
     @classmethod
     def update_last_view(cls, user):
         """Update last time user saw lenta"""
@@ -1324,6 +1587,7 @@ class LentaLastView(models.Model):
         except cls.DoesNotExist:
             view = cls(user=user)
             view.save()
+        cache.set(cls._counter_key(user.id), 0, cls.COUNTER_TIME)
 
     class Meta:
         unique_together = ('date', 'user')
@@ -1348,3 +1612,66 @@ class Blocks(models.Model):
     class Meta:
         verbose_name = _("Ban")
         verbose_name_plural = _("Bans")
+
+
+models.signals.post_delete.connect(
+    lambda instance, **kwargs: leaderboard.blogs.remove(instance),
+    sender=Blog, weak=False,
+)
+models.signals.post_delete.connect(
+    lambda instance, **kwargs: leaderboard.users.remove(instance),
+    sender=Profile, weak=False,
+)
+models.signals.post_save.connect(activity.on_post_save, sender=Post)
+models.signals.post_delete.connect(activity.on_post_delete, sender=Post)
+models.signals.post_save.connect(activity.on_comment_save, sender=Comment)
+models.signals.post_delete.connect(activity.on_comment_delete, sender=Comment)
+
+
+def _comment_added(instance, created, **kwargs):
+    if created and instance.depth > 1:
+        Post.objects.filter(id=instance.post_id).update(
+            comment_count=models.F('comment_count') + 1,
+        )
+
+
+def _comment_removed(instance, **kwargs):
+    if instance.depth > 1 and not instance.is_removed:
+        Post.objects.filter(id=instance.post_id).update(
+            comment_count=models.F('comment_count') - 1,
+        )
+
+models.signals.post_save.connect(_comment_added, sender=Comment)
+models.signals.post_delete.connect(_comment_removed, sender=Comment)
+models.signals.post_save.connect(treecache.on_comment_change, sender=Comment)
+models.signals.post_delete.connect(treecache.on_comment_change, sender=Comment)
+models.signals.post_save.connect(treecache.on_post_save, sender=Post)
+models.signals.post_save.connect(treecache.on_profile_save, sender=Profile)
+
+
+def _invalidate_capabilities(instance, **kwargs):
+    if isinstance(instance, User):
+        Access.invalidate(instance.id)
+    else:
+        Access.invalidate()
+
+models.signals.post_save.connect(_invalidate_capabilities, sender=User)
+models.signals.m2m_changed.connect(
+    _invalidate_capabilities, sender=User.user_permissions.through,
+)
+models.signals.m2m_changed.connect(
+    _invalidate_capabilities, sender=User.groups.through,
+)
+models.signals.m2m_changed.connect(
+    _invalidate_capabilities, sender=Group.permissions.through,
+)
+# deleting permission or group drops m2m rows without m2m_changed
+models.signals.post_delete.connect(_invalidate_capabilities, sender=Permission)
+models.signals.post_delete.connect(_invalidate_capabilities, sender=Group)
+
+counts.watch(Post, Comment, Notify, Profile, Blog, BlogType, Timeline, Favourite)
+models.signals.post_save.connect(timelines.on_post_save, sender=Post)
+models.signals.pre_delete.connect(tagindex.on_post_pre_delete, sender=Post)
+models.signals.post_delete.connect(tagindex.on_post_delete, sender=Post)
+models.signals.post_save.connect(timelines.on_blog_save, sender=Blog)
+models.signals.post_save.connect(timelines.on_blog_type_save, sender=BlogType)
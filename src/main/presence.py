@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.core.cache import cache
+from main.utils import CacheLog
+import datetime
+import time
+
+
+PRESENCE_CACHE_KEY = 'main_presence'
+PRESENCE_USER_KEY = 'main_presence_user_%d'
+PRESENCE_LOG_KEY = 'main_presence_log'
+ONLINE_TIME = getattr(settings, 'ONLINE_TIME', 600)
+PRESENCE_FLUSH_TIME = getattr(settings, 'PRESENCE_FLUSH_TIME', 30)
+PRESENCE_LOG_TIME = getattr(settings, 'PRESENCE_LOG_TIME', 24 * 60 * 60)
+PRESENCE_RESOLUTION = datetime.timedelta(
+    seconds=getattr(settings, 'PRESENCE_RESOLUTION', 60),
+)
+
+_log = CacheLog(PRESENCE_LOG_KEY, PRESENCE_LOG_TIME)
+_last_flush = [time.time()]
+
+
+def _online_since(seconds):
+    return datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+
+
+def get_presence():
+    """Get map user_id -> (username, last seen) of flushed visits"""
+    presence = cache.get(PRESENCE_CACHE_KEY)
+    if presence is None:
+        from main.models import LastVisit
+        presence = {}
+        for visit in LastVisit.objects.filter(
+            date__gt=_online_since(ONLINE_TIME),
+        ).select_related('user'):
+            presence[visit.user_id] = (visit.user.username, visit.date)
+        cache.set(PRESENCE_CACHE_KEY, presence, PRESENCE_FLUSH_TIME)
+    return presence
+
+
+def touch(user):
+    """Mark user as seen now
+
+    Only user own key is read per request, visit is logged for flush
+    once per PRESENCE_RESOLUTION.
+
+    Keyword arguments:
+    user -- User
+
+    Returns: None
+    """
+    now = datetime.datetime.now()
+    seen = cache.get(PRESENCE_USER_KEY % (user.id,))
+    if seen is None or now - seen > PRESENCE_RESOLUTION:
+        cache.set(PRESENCE_USER_KEY % (user.id,), now, ONLINE_TIME)
+        _log.append((user.id, now))
+    if time.time() - _last_flush[0] > PRESENCE_FLUSH_TIME:
+        flush()
+
+
+def _write(visits):
+    from main.models import LastVisit
+    pending = {}
+    for user_id, date in visits:
+        pending[user_id] = max(date, pending.get(user_id, date))
+    if not pending:
+        return
+    existing = set(LastVisit.objects.filter(
+        user__in=pending.keys(),
+    ).values_list('user', flat=True))
+    by_date = {}
+    for user_id in existing:
+        by_date.setdefault(pending[user_id], []).append(user_id)
+    for date, user_ids in by_date.items():
+        LastVisit.objects.filter(user__in=user_ids).update(date=date)
+    for user_id in set(pending.keys()) - existing:
+        visit = LastVisit.objects.create(user_id=user_id)
+        # date is auto_now, create stores flush time
+        LastVisit.objects.filter(id=visit.id).update(date=pending[user_id])
+    cache.delete(PRESENCE_CACHE_KEY)
+
+
+def flush():
+    """Write logged visits to LastVisit, each user gets own visit time"""
+    _last_flush[0] = time.time()
+    _log.flush(_write, PRESENCE_FLUSH_TIME)
+
+
+def is_online(user):
+    """Check user seen in ONLINE_TIME"""
+    seen = cache.get(PRESENCE_USER_KEY % (user.id,))
+    if seen is None:
+        seen = get_presence().get(user.id, (None, None))[1]
+    return seen is not None and seen > _online_since(ONLINE_TIME)
+
+
+def get_online(seconds=ONLINE_TIME):
+    """Get names of users seen in last seconds"""
+    since = _online_since(seconds)
+    return sorted(
+        username for username, date in get_presence().values()
+        if date > since
+    )
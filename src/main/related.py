@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+import cPickle
+import heapq
+import math
+import os
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.html import strip_tags
+
+
+RELATED_POSTS_COUNT = getattr(settings, 'RELATED_POSTS_COUNT', 10)
+RELATED_POSTS_CHUNK = getattr(settings, 'RELATED_POSTS_CHUNK', 1000)
+RELATED_POSTS_PATH = getattr(
+    settings, 'RELATED_POSTS_PATH',
+    os.path.join(settings.PROJECT_ROOT, 'related_posts.pickle'),
+)
+WORD_RE = re.compile(r'\w\w+', re.UNICODE)
+_index = {'mtime': None}
+
+
+def tokenize(title, text, raw_tags):
+    """Get tokens of post, tags are kept whole"""
+    tokens = WORD_RE.findall(u'%s %s' % (title, strip_tags(text or '')))
+    tokens += [u'tag:%s' % tag.strip() for tag in (raw_tags or '').split(',') if tag.strip()]
+    return [token.lower() for token in tokens]
+
+
+def _weights(tokens, vocabulary, idf):
+    """Get normalized tf-idf weights of known tokens as (column, weight)"""
+    counts = {}
+    for token in tokens:
+        column = vocabulary.get(token)
+        if column is not None:
+            counts[column] = counts.get(column, 0) + 1
+    weights = [
+        (column, (1 + math.log(count)) * idf[column])
+        for column, count in counts.items()
+    ]
+    norm = math.sqrt(sum(weight * weight for column, weight in weights)) or 1
+    return [(column, weight / norm) for column, weight in weights]
+
+
+def _vectorize(documents, vocabulary=None, idf=None):
+    """Make csr matrix of tf-idf rows from lists of tokens"""
+    import numpy
+    from scipy import sparse
+    if vocabulary is None:
+        vocabulary = {}
+        frequency = []
+        for tokens in documents:
+            for token in set(tokens):
+                if token not in vocabulary:
+                    vocabulary[token] = len(frequency)
+                    frequency.append(0)
+                frequency[vocabulary[token]] += 1
+        total = len(documents)
+        idf = numpy.log((1. + total) / (1. + numpy.array(frequency, dtype=float))) + 1
+    data, indices, indptr = [], [], [0]
+    for tokens in documents:
+        for column, weight in _weights(tokens, vocabulary, idf):
+            indices.append(column)
+            data.append(weight)
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix(
+        (data, indices, indptr), shape=(len(documents), len(vocabulary)),
+    )
+    return matrix, vocabulary, idf
+
+
+def _top(ids, row_ids, scores, exclude, count):
+    """Get count best (related id, score) of one row"""
+    return heapq.nlargest(count, [
+        (float(score), int(ids[column])) for column, score in zip(row_ids, scores)
+        if ids[column] != exclude
+    ])
+
+
+_job = {}
+
+
+def _neighbours(bounds):
+    """Find neighbours of rows in [start, stop), runs in pool workers"""
+    start, stop = bounds
+    matrix, ids, count = _job['matrix'], _job['ids'], _job['count']
+    similar = (matrix[start:stop] * matrix.T).tocsr()
+    result = []
+    for num in range(stop - start):
+        row = similar[num]
+        post_id = int(ids[start + num])
+        result += [
+            (post_id, related_id, score)
+            for score, related_id in _top(ids, row.indices, row.data, post_id, count)
+        ]
+    return result
+
+
+@transaction.commit_on_success
+def _write(rows, post_ids=None):
+    """Replace neighbours of post_ids, of all posts when None
+
+    Rows pointing to posts deleted since the matrix was built are skipped.
+    """
+    from main.models import Post, RelatedPost
+    if post_ids is None:
+        RelatedPost.objects.all().delete()
+        existing = set(Post.objects.values_list('id', flat=True))
+    else:
+        RelatedPost.objects.filter(post__in=post_ids).delete()
+        existing = set(Post.objects.filter(id__in=set(
+            [row[0] for row in rows] + [row[1] for row in rows],
+        )).values_list('id', flat=True))
+    rows = [row for row in rows if row[0] in existing and row[1] in existing]
+    cursor = connection.cursor()
+    cursor.executemany(
+        'INSERT INTO %s (post_id, related_id, score) VALUES (%%s, %%s, %%s)' % (
+            connection.ops.quote_name(RelatedPost._meta.db_table),
+        ), rows,
+    )
+
+
+def build(processes=None, count=RELATED_POSTS_COUNT, chunk=RELATED_POSTS_CHUNK):
+    """Rebuild tf-idf matrix and neighbour table of all posts
+
+    Keyword arguments:
+    processes -- Integer, pool size, all cores by default
+    count -- Integer, neighbours per post
+    chunk -- Integer, rows multiplied at once by one worker
+
+    Returns: Integer
+    """
+    from multiprocessing import Pool
+    import numpy
+    from main.models import Post
+    ids, documents = [], []
+    for id, title, text, raw_tags in Post.objects.values_list(
+        'id', 'title', 'text', 'raw_tags',
+    ).order_by('id').iterator():
+        ids.append(id)
+        documents.append(tokenize(title, text, raw_tags))
+    matrix, vocabulary, idf = _vectorize(documents)
+    ids = numpy.array(ids)
+    _job.update(matrix=matrix, ids=ids, count=count)
+    # workers are forked after matrix is set, so it is shared not pickled
+    connection.close()
+    pool = Pool(processes)
+    try:
+        rows = []
+        for part in pool.imap(_neighbours, [
+            (start, min(start + chunk, len(ids)))
+            for start in range(0, len(ids), chunk)
+        ]):
+            rows += part
+    finally:
+        pool.close()
+        pool.join()
+        _job.clear()
+    _write(rows)
+    path = RELATED_POSTS_PATH + '.tmp'
+    with open(path, 'wb') as index_file:
+        cPickle.dump({
+            'matrix': matrix,
+            'vocabulary': vocabulary,
+            'idf': idf,
+            'ids': ids,
+        }, index_file, cPickle.HIGHEST_PROTOCOL)
+    os.rename(path, RELATED_POSTS_PATH)
+    return len(ids)
+
+
+def _get_index():
+    """Load index saved by last build, reload when file changes"""
+    try:
+        mtime = os.path.getmtime(RELATED_POSTS_PATH)
+    except OSError:
+        return None
+    if _index['mtime'] != mtime:
+        with open(RELATED_POSTS_PATH, 'rb') as index_file:
+            _index.update(cPickle.load(index_file))
+        _index['mtime'] = mtime
+    return _index
+
+
+def _score(index, post, count):
+    vector, vocabulary, idf = _vectorize(
+        [tokenize(post.title, post.text, post.raw_tags)],
+        index['vocabulary'], index['idf'],
+    )
+    similar = (index['matrix'] * vector.T).tocsc()
+    return [
+        (post.id, related_id, score)
+        for score, related_id in _top(
+            index['ids'], similar.indices, similar.data, post.id, count,
+        )
+    ]
+
+
+def score_post(post, count=RELATED_POSTS_COUNT):
+    """Find neighbours of new post in existing matrix
+
+    Keyword arguments:
+    post -- Post
+    count -- Integer
+
+    Returns: Integer or None when index not built
+    """
+    index = _get_index()
+    if index is None:
+        return None
+    rows = _score(index, post, count)
+    _write(rows, [post.id])
+    return len(rows)
+
+
+def score_new(count=RELATED_POSTS_COUNT):
+    """Score posts created after last build which have no neighbours yet
+
+    Returns: Integer or None when index not built
+    """
+    from main.models import Post, RelatedPost
+    index = _get_index()
+    if index is None:
+        return None
+    posts = Post.objects.exclude(
+        id__in=RelatedPost.objects.values('post'),
+    ).only('id', 'title', 'text', 'raw_tags')
+    if len(index['ids']):
+        posts = posts.filter(id__gt=int(index['ids'].max()))
+    scored = 0
+    for post in posts.iterator():
+        score_post(post, count)
+        scored += 1
+    return scored
+
+
+def get_posts(post):
+    """Get precomputed related posts, best first"""
+    from main.models import RelatedPost
+    return [
+        related.related for related in RelatedPost.objects.filter(
+            post=post,
+        ).select_related('related', 'related__author', 'related__blog')
+    ]
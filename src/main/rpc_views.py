@@ -19,6 +19,7 @@ from django.shortcuts import get_object_or_404
 from jsonrpc import jsonrpc_method
 from main.models import Post, Comment, Blog, Favourite, Spy, Profile, Draft
 from main.utils import Access
+from main import leaderboard, activity
 from main.forms import PostOptions
 from baseutils.jrpc import to_json
 from django.utils.translation import ugettext as _
@@ -104,7 +105,11 @@ def get_val(method, panel_type, panel_key=''):
                 count = 20
             if panel:
                 request.session['right_panel%s' % panel_key] = panel_type
-            return map(to_json, fnc(request, count))
+            # cached feeds return entries already serialized by to_json
+            return [
+                obj if isinstance(obj, dict) else to_json(obj)
+                for obj in fnc(request, count)
+            ]
         return wrapper
     return decorator
 
@@ -112,37 +117,29 @@ def get_val(method, panel_type, panel_key=''):
 @get_val('get_last_comments', 'comments')
 def get_last_comments(request, count):
     """Get last comments"""
-    return Comment.objects.exclude(depth=1).select_related(
-        'post', 'post.blog', 'post.author',
-    ).order_by('-id')[:count]
+    return [
+        entry['json'] for entry in activity.get(activity.TYPE_COMMENT, count)
+    ]
 
 
 @get_val('get_last_posts', 'posts')
 def get_last_posts(request, count):
     """Get last posts"""
-    return Post.objects.select_related(
-        'blog', 'author',
-    ).order_by('-id')[:count]
+    return [
+        entry['json'] for entry in activity.get(activity.TYPE_POST, count)
+    ]
 
 
 @get_val('get_users', 'users', '_2')
 def get_users(request, count):
     """Get users"""
-    return Profile.objects.select_related('user').extra(
-        select={
-            'fullrate': "rate+%f*posts_rate+%f*blogs_rate+%f*comments_rate" % (
-                settings.POST_RATE_COEFFICIENT,
-                settings.BLOG_RATE_COEFFICIENT,
-                settings.COMMENT_RATE_COEFFICIENT),
-            },
-        order_by=['-fullrate'],
-    )[:count]
+    return [entry['json'] for entry in leaderboard.users.get(count)]
 
 
 @get_val('get_blogs', 'blogs', '_2')
 def get_blogs(request, count):
     """Get blogs"""
-    return Blog.objects.order_by('-rate')[:count]
+    return [entry['json'] for entry in leaderboard.blogs.get(count)]
 
 
 @login_required
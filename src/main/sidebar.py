@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from main import activity, leaderboard, tagstats
+from main.models import (
+    Post, Comment, Blog, City, Profile, LastVisit,
+    PostRate, CommentRate, BlogRate, UserRate,
+)
+
+
+SIDEBAR_CACHE_KEY = 'main_sidebar_snapshot'
+SIDEBAR_SNAPSHOT_TIME = getattr(settings, 'SIDEBAR_SNAPSHOT_TIME', 60)
+SIDEBAR_KEYS = (
+    'top_post_comment', 'top_profiles', 'top_blogs',
+    'blogs_count', 'profiles_count', 'city_count',
+    'ONLINE', 'LAST_USERS', 'SITE_DOMAIN', 'keywords', 'TAG_CLOUD',
+)
+
+
+def build_snapshot():
+    """Compute all not user-specific sidebar values"""
+    return {
+        'top_post_comment': activity.get_merged(20),
+        'top_profiles': [{
+            'name': profile['username'],
+            'rate': profile['fullrate'],
+        } for profile in leaderboard.users.get(10)],
+        'top_blogs': leaderboard.blogs.get(10),
+        'blogs_count': Blog.objects.count(),
+        'profiles_count': Profile.objects.count(),
+        'city_count': City.objects.count(),
+        'ONLINE': LastVisit.get_online(),
+        'LAST_USERS': list(User.objects.order_by('-id').values_list(
+            'username', flat=True,
+        )[:10]),
+        'SITE_DOMAIN': Site.objects.get_current().domain,
+        'keywords': tagstats.get_keywords(),
+        'TAG_CLOUD': tagstats.get_cloud(),
+    }
+
+
+def get_snapshot():
+    """Get sidebar snapshot, rebuild it when expired"""
+    snapshot = cache.get(SIDEBAR_CACHE_KEY)
+    if snapshot is None:
+        snapshot = build_snapshot()
+        cache.set(SIDEBAR_CACHE_KEY, snapshot, SIDEBAR_SNAPSHOT_TIME)
+    return snapshot
+
+
+def invalidate_snapshot(*args, **kwargs):
+    """Drop sidebar snapshot, next request rebuild it"""
+    cache.delete(SIDEBAR_CACHE_KEY)
+
+
+def _on_user_save(instance, created, **kwargs):
+    # every login saves last_login, only new users change snapshot
+    if created:
+        invalidate_snapshot()
+
+
+for model in (Post, Comment, Blog, PostRate, CommentRate, BlogRate, UserRate):
+    post_save.connect(invalidate_snapshot, sender=model)
+    post_delete.connect(invalidate_snapshot, sender=model)
+post_save.connect(_on_user_save, sender=User)
+post_delete.connect(invalidate_snapshot, sender=User)
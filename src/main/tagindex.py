@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from bisect import bisect_left
+from hashlib import md5
+from heapq import merge
+from django.conf import settings
+from django.core.cache import cache
+from tagging import settings as tagging_settings
+from tagging.models import Tag, TaggedItem
+from main.timelines import TimelinePosts
+from main.utils import get_version, bump_version
+
+
+TAG_INDEX_CACHE_KEY = 'main_tag_index_%s'
+TAG_INDEX_TIME = getattr(settings, 'TAG_INDEX_TIME', 24 * 60 * 60)
+AND = '+'
+OR = '|'
+
+
+def _version_key(name):
+    return TAG_INDEX_CACHE_KEY % (md5(name.encode('utf-8')).hexdigest(),)
+
+
+def _key(name):
+    key = _version_key(name)
+    return '%s_%s' % (key, get_version(key, TAG_INDEX_TIME))
+
+
+def _normalize(name):
+    name = name.strip()
+    if tagging_settings.FORCE_LOWERCASE_TAGS:
+        name = name.lower()
+    return name
+
+
+def rebuild(name):
+    """Load ascending post ids of tag from db"""
+    from main.models import Post
+    ids = sorted(TaggedItem.objects.get_by_model(
+        Post, Tag.objects.filter(name=name),
+    ).values_list('id', flat=True))
+    cache.set(_key(name), ids, TAG_INDEX_TIME)
+    return ids
+
+
+def get_ids(name):
+    """Get ascending post ids of tag"""
+    ids = cache.get(_key(name))
+    if ids is None:
+        ids = rebuild(name)
+    return ids
+
+
+def invalidate(name):
+    """Drop cached ids of tag, next read loads them from db"""
+    bump_version(_version_key(name), TAG_INDEX_TIME)
+
+
+def _get_names(post):
+    return set(tag.name for tag in Tag.objects.get_for_object(post))
+
+
+def update_tags(post, tag_names):
+    """Set tags of post and update index
+
+    Keyword arguments:
+    post -- Post
+    tag_names -- String, passed to Tag.objects.update_tags
+
+    Returns: None
+    """
+    old = _get_names(post)
+    Tag.objects.update_tags(post, tag_names)
+    new = _get_names(post)
+    for name in new ^ old:
+        invalidate(name)
+
+
+def on_post_pre_delete(instance, **kwargs):
+    instance._tag_index_names = _get_names(instance)
+
+
+def on_post_delete(instance, **kwargs):
+    for name in getattr(instance, '_tag_index_names', ()):
+        invalidate(name)
+
+
+def _gallop(ids, value, lo):
+    """Find position of value in ascending ids starting from lo"""
+    step = 1
+    hi = lo
+    while hi < len(ids) and ids[hi] < value:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(ids, value, lo, min(hi + 1, len(ids)))
+
+
+def intersect(lists):
+    """Intersect ascending lists, smallest list drives the search"""
+    lists = sorted(lists, key=len)
+    if not lists:
+        return []
+    result = lists[0]
+    for ids in lists[1:]:
+        found = []
+        pos = 0
+        for value in result:
+            pos = _gallop(ids, value, pos)
+            if pos == len(ids):
+                break
+            if ids[pos] == value:
+                found.append(value)
+        result = found
+        if not result:
+            break
+    return result
+
+
+def union(lists):
+    """Merge ascending lists without duplicates"""
+    result = []
+    for value in merge(*lists):
+        if not result or result[-1] != value:
+            result.append(value)
+    return result
+
+
+def parse_query(query):
+    """Split tag query to names and operation
+
+    Keyword arguments:
+    query -- String, "a+b" for posts with all tags, "a|b" for any of them
+
+    Returns: tuple of list and operation
+    """
+    operation = OR if OR in query else AND
+    names = filter(None, map(_normalize, query.split(operation)))
+    return names, operation
+
+
+def get_posts(query):
+    """Get posts matching tag query, newest first
+
+    Returns: TaggedPosts
+    """
+    names, operation = parse_query(query)
+    lists = map(get_ids, names)
+    ids = intersect(lists) if operation == AND else union(lists)
+    ids.reverse()
+    return TaggedPosts(ids)
+
+
+class TaggedPosts(TimelinePosts):
+    """Lazy list of posts from tag index"""
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def count(self):
+        return len(self.ids)
+
+    def _get_ids(self, key):
+        return self.ids[key]
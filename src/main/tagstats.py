@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from django.core.cache import cache
+from tagging.models import Tag
+from tagging.utils import calculate_cloud, LOGARITHMIC
+from main.utils import get_version, bump_version
+
+
+TAGSTATS_CACHE_KEY = 'main_tag_stats'
+TAGSTATS_TIME = getattr(settings, 'TAGSTATS_TIME', 24 * 60 * 60)
+TAG_CLOUD_MIN_COUNT = getattr(settings, 'TAG_CLOUD_MIN_COUNT', 20)
+TAG_CLOUD_STEPS = getattr(settings, 'TAG_CLOUD_STEPS', 9)
+KEYWORD_MIN_COUNT = getattr(settings, 'KEYWORD_MIN_COUNT', 50)
+
+
+class CloudTag(object):
+    """Tag with usage count"""
+
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+
+
+def _stats_key():
+    return '%s_%s' % (
+        TAGSTATS_CACHE_KEY, get_version(TAGSTATS_CACHE_KEY, TAGSTATS_TIME),
+    )
+
+
+def _store(counts):
+    """Precalculate cloud and keywords and put all to cache"""
+    tags = [
+        CloudTag(name, count) for name, count in sorted(counts.items())
+        if count >= TAG_CLOUD_MIN_COUNT
+    ]
+    calculate_cloud(tags, TAG_CLOUD_STEPS, LOGARITHMIC)
+    stats = {
+        'counts': counts,
+        'cloud': [{
+            'name': tag.name,
+            'count': tag.count,
+            'font_size': tag.font_size,
+        } for tag in tags],
+        'keywords': ', '.join([
+            name for name, count in sorted(counts.items())
+            if count >= KEYWORD_MIN_COUNT
+        ][:10]),
+    }
+    cache.set(_stats_key(), stats, TAGSTATS_TIME)
+    return stats
+
+
+def rebuild():
+    """Count tags usage for posts in db"""
+    from main.models import Post
+    return _store(dict(
+        (tag.name, tag.count)
+        for tag in Tag.objects.usage_for_model(Post, counts=True)
+    ))
+
+
+def get_stats():
+    stats = cache.get(_stats_key())
+    if stats is None:
+        stats = rebuild()
+    return stats
+
+
+def invalidate():
+    """Drop stats after post tags changed, next read counts them in db
+
+    Stats are not patched in cache, concurrent posts would lose counts.
+    """
+    bump_version(TAGSTATS_CACHE_KEY, TAGSTATS_TIME)
+
+
+def get_cloud():
+    """Get tag cloud, list of dicts with name, count and font_size"""
+    return get_stats()['cloud']
+
+
+def get_keywords():
+    """Get meta keywords"""
+    return get_stats()['keywords']
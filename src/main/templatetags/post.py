@@ -14,31 +14,23 @@
 #       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #       MA 02110-1301, USA.
 from django import template
-from main.models import LastView
+from main.models import Post
 
 
 register = template.Library()
 
 @register.inclusion_tag('comments_count.html', takes_context=True)
 def comments_count(context):
-    """Spike for answers printing"""
+    """Comments count with count of new, counted for all page at once"""
     post = context['post']
-    user = context['request'].user
-    try:
-        count = post.get_comment().count()
-        if user.is_authenticated():
-            try:
-                new_count = post.get_comment().filter(
-                    created__gt=LastView.objects.get(post=post, user=user).date
-                ).count()
-            except LastView.DoesNotExist:
-                new_count = count
-        else:
-            new_count = -1
-    except AttributeError:
-        count = 0
-        new_count = 0
+    new_counts = context.render_context.get('main_new_comment_counts')
+    if new_counts is None or post.id not in new_counts:
+        posts = list(context.get('object_list') or [])
+        if post not in posts:
+            posts = [post]
+        new_counts = Post.get_new_comment_counts(posts, context['request'].user)
+        context.render_context['main_new_comment_counts'] = new_counts
     return {
-        'count': count,
-        'new_count': new_count
+        'count': post.comment_count,
+        'new_count': new_counts[post.id],
     }
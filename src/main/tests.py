@@ -1,13 +1,33 @@
+import datetime
 import json
-from django.contrib.auth.models import User
+import os
+import shutil
+import tempfile
+from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template import Context
 from django.test import TestCase
+from django.utils import unittest
 from main.forms import (
     CreateBlogForm, CreatePostForm,
     CreateAnswerForm, EditPostForm,
     EditDraftForm, PostOptions,
 )
-from main.models import Profile, Post, Answer, BlogType, Blog, UserInBlog, Draft
+from main.models import Profile, Post, Answer, BlogType, Blog, UserInBlog, Draft, LastVisit, LentaLastView, Notify, LastView, Favourite, Comment
+from main import presence, leaderboard, tagstats, activity, identity, treecache, lastviews, timelines, tagindex, related, counts
+from main.leaderboard import Leaderboard
+from main.broker import LocalBroker, CacheBroker
+from main.commenttree import path_step
+from main.counts import counted, MODE_EXACT, MODE_ESTIMATED
+from main.sidebar import SIDEBAR_CACHE_KEY, get_snapshot, invalidate_snapshot
+from main.utils import LazyValue, Access, CacheLog, render_each
 from django.conf import settings
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
 
 
 class PostTest(TestCase):
@@ -174,3 +194,764 @@ class PostTest(TestCase):
         self.assertTrue(form.is_valid(), msg='options validating')
         post = form.save()
         self.assertTrue(post.disable_rate, msg='test options')
+
+
+class SidebarTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        Profile.objects.create(user=self.user)
+        invalidate_snapshot()
+
+    def test_snapshot_cached(self):
+        snapshot = get_snapshot()
+        self.assertEqual(snapshot['profiles_count'], 1, msg='snapshot data broken')
+        self.assertEqual(
+            cache.get(SIDEBAR_CACHE_KEY), snapshot,
+            msg='snapshot not cached',
+        )
+
+    def test_snapshot_invalidation(self):
+        get_snapshot()
+        Post.objects.create(author=self.user, title='okok', text='eeee')
+        self.assertIsNone(
+            cache.get(SIDEBAR_CACHE_KEY),
+            msg='snapshot not invalidated by new post',
+        )
+        self.assertEqual(
+            get_snapshot()['top_post_comment'][0]['post_title'], 'okok',
+            msg='snapshot not rebuilt',
+        )
+
+    def test_login_keeps_snapshot(self):
+        get_snapshot()
+        self.user.last_login = datetime.datetime.now()
+        self.user.save()
+        self.assertIsNotNone(
+            cache.get(SIDEBAR_CACHE_KEY), msg='snapshot dropped on login',
+        )
+        User.objects.create(username='new')
+        self.assertIsNone(
+            cache.get(SIDEBAR_CACHE_KEY), msg='snapshot kept for new user',
+        )
+
+
+class RenderEachTest(TestCase):
+    def test_render(self):
+        user = User.objects.create(username='test')
+        post = Post.objects.create(author=user, title='okok', text='eeee')
+        root = post.create_comment_root()
+        comments = [root.add_child(
+            post=post, author=user, text='comment %d' % num,
+            created=datetime.datetime.now(),
+        ) for num in range(2)]
+        context = Context({'post': post, 'TIMEZONE': settings.TIME_ZONE})
+        contents = render_each('single_comment.html', comments, context, 'comment')
+        self.assertEqual(len(contents), 2, msg='not all rendered')
+        self.assertTrue('comment 1' in contents[1], msg='wrong object rendered')
+        self.assertFalse('comment' in context, msg='context not restored')
+
+
+class CacheLogTest(TestCase):
+    def setUp(self):
+        self.log = CacheLog('main_test_log', 60)
+        cache.delete_many(['main_test_log_%s' % name for name in (
+            'seq', 'flushed', 'missing', 'lock', 1, 2, 3,
+        )])
+
+    def _flush(self):
+        values = []
+        self.log.flush(values.extend, 60)
+        return values
+
+    def test_flush(self):
+        self.log.append('a')
+        self.log.append('b')
+        self.assertEqual(self._flush(), ['a', 'b'], msg='values not flushed')
+        self.assertEqual(self._flush(), [], msg='values flushed twice')
+
+    def test_reserved_entry(self):
+        self.log.append('a')
+        cache.incr('main_test_log_seq')
+        self.log.append('c')
+        self.assertEqual(self._flush(), ['a'], msg='flushed past reserved entry')
+        cache.set('main_test_log_2', 'b')
+        self.assertEqual(self._flush(), ['b', 'c'], msg='reserved entry lost')
+
+
+class LazyValueTest(TestCase):
+    def test_memoized(self):
+        calls = []
+        value = LazyValue(lambda: calls.append(1) or len(calls))
+        self.assertEqual(calls, [], msg='value computed eagerly')
+        self.assertEqual(value(), 1, msg='value broken')
+        self.assertEqual(value(), 1, msg='value not memoized')
+
+
+class PresenceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.profile = Profile.objects.create(user=self.user)
+        cache.delete(presence.PRESENCE_CACHE_KEY)
+        cache.delete(presence.PRESENCE_USER_KEY % (self.user.id,))
+
+    def test_online(self):
+        self.assertFalse(self.profile.is_online(), msg='online before visit')
+        self.profile.update_last_visit()
+        self.assertTrue(self.profile.is_online(), msg='visit not tracked')
+        presence.flush()
+        self.assertEqual(LastVisit.get_online(), ['test'], msg='online list broken')
+
+    def test_flush(self):
+        self.profile.update_last_visit()
+        presence.flush()
+        self.assertEqual(
+            LastVisit.objects.filter(user=self.user).count(), 1,
+            msg='visit not flushed to db',
+        )
+        self.profile.update_last_visit()
+        presence.flush()
+        self.assertEqual(
+            LastVisit.objects.filter(user=self.user).count(), 1,
+            msg='flush duplicates visits',
+        )
+
+    def test_flush_own_dates(self):
+        other = User.objects.create(username='other')
+        LastVisit.objects.create(user=other)
+        seen = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(minutes=5)
+        presence._log.append((self.user.id, seen))
+        presence._log.append((other.id, datetime.datetime.now()))
+        presence.flush()
+        self.assertEqual(
+            LastVisit.objects.get(user=self.user).date, seen,
+            msg='visit date of other user written',
+        )
+
+
+class FullrateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.profile = Profile.objects.create(user=self.user, rate=10)
+
+    def test_saved(self):
+        self.assertEqual(self.profile.fullrate, 10, msg='fullrate not stored')
+
+    def test_rate_blog(self):
+        BlogType.objects.create(name=settings.DEFAULT_BLOG_TYPE)
+        blog = Blog.objects.create(name='okok', owner=self.user)
+        blog.rate_blog(User.objects.create(username='rater'), +1)
+        profile = Profile.objects.get(id=self.profile.id)
+        self.assertAlmostEqual(
+            profile.fullrate, profile.get_rate(),
+            msg='fullrate not synced on blog rate',
+        )
+
+    def test_update_fullrate(self):
+        Profile.objects.filter(id=self.profile.id).update(posts_rate=10, fullrate=0)
+        Profile.update_fullrate()
+        profile = Profile.objects.get(id=self.profile.id)
+        self.assertAlmostEqual(
+            profile.fullrate, profile.get_rate(),
+            msg='fullrate backfill broken',
+        )
+
+
+class LeaderboardTest(TestCase):
+    def setUp(self):
+        cache.delete(leaderboard.users.key)
+        self.profiles = [
+            Profile.objects.create(
+                user=User.objects.create(username='user%d' % rate),
+                rate=rate,
+            ) for rate in range(5)
+        ]
+
+    def test_top(self):
+        self.assertEqual(
+            [data['username'] for data in leaderboard.users.get(3)],
+            ['user4', 'user3', 'user2'], msg='leaderboard order broken',
+        )
+
+    def test_update(self):
+        profile = self.profiles[0]
+        profile.rate = 10
+        profile.save()
+        self.assertEqual(
+            leaderboard.users.get(1)[0]['username'], 'user0',
+            msg='leaderboard not updated',
+        )
+
+    def test_bounded(self):
+        board = Leaderboard(
+            'test', leaderboard._profiles,
+            lambda profile: profile.get_rate(),
+            leaderboard._serialize_profile, size=2,
+        )
+        board.rebuild()
+        profile = self.profiles[4]
+        profile.rate = -1
+        profile.save()
+        board.update(profile)
+        self.assertEqual(
+            [data['username'] for data in board.get(2)],
+            ['user3', 'user2'], msg='leaderboard not refilled',
+        )
+
+
+class LentaCounterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.author = User.objects.create(username='author')
+        self.post = Post.objects.create(author=self.author, title='okok', text='eeee')
+        LentaLastView.update_last_view(self.user)
+
+    def test_counter(self):
+        self.assertEqual(LentaLastView.get_count(self.user), 0, msg='counter not reset')
+        Notify.new_notify(True, self.post, self.user)
+        self.assertEqual(LentaLastView.get_count(self.user), 1, msg='counter not incremented')
+        LentaLastView.update_last_view(self.user)
+        self.assertEqual(LentaLastView.get_count(self.user), 0, msg='counter not reset')
+
+
+class TagStatsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        Profile.objects.create(user=self.user)
+        cache.delete(tagstats.TAGSTATS_CACHE_KEY)
+
+    def test_counts(self):
+        self.assertEqual(tagstats.get_stats()['counts'], {}, msg='stats not empty')
+        form = CreatePostForm(self.user, {
+            'type': Post.TYPE_POST,
+            'title': 'OKOK!',
+            'text': 'good',
+            'raw_tags': 'op, ko',
+        })
+        self.assertTrue(form.is_valid(), msg='post validation failed')
+        form.save()
+        self.assertEqual(
+            tagstats.get_stats()['counts'], {'op': 1, 'ko': 1},
+            msg='tags not counted',
+        )
+        self.assertEqual(
+            tagstats.rebuild()['counts'], {'op': 1, 'ko': 1},
+            msg='tags counted not same as in db',
+        )
+
+
+class ActivityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        cache.delete(activity.ACTIVITY_CACHE_KEY)
+
+    def test_push(self):
+        post = Post.objects.create(author=self.user, title='okok', text='eeee')
+        entries = activity.get(activity.TYPE_POST)
+        self.assertEqual(len(entries), 1, msg='post not pushed')
+        self.assertEqual(entries[0]['url'], '/post/%d/' % post.id, msg='entry broken')
+        root = post.create_comment_root()
+        comment = root.add_child(
+            post=post, author=self.user, text='ok',
+            created=datetime.datetime.now(),
+        )
+        entries = activity.get(activity.TYPE_COMMENT)
+        self.assertEqual(
+            [entry['id'] for entry in entries], [comment.id],
+            msg='comment not pushed or root pushed',
+        )
+        comment.delete()
+        self.assertEqual(activity.get(activity.TYPE_COMMENT), [], msg='comment not removed')
+
+
+class IdentityMapTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        Profile.objects.create(user=self.user)
+
+    def tearDown(self):
+        identity.clear()
+
+    def test_same_object(self):
+        identity.start()
+        profile = self.user.get_profile()
+        self.assertIs(self.user.get_profile(), profile, msg='profile fetched twice')
+        self.assertIs(
+            identity.get_many(Profile, [self.user], 'user')[self.user.id], profile,
+            msg='get_many not use map',
+        )
+        identity.clear()
+        self.assertIsNot(self.user.get_profile(), profile, msg='map not cleared')
+
+    def test_evict_after_rate(self):
+        identity.start()
+        profile = self.user.get_profile()
+        BlogType.objects.create(name=settings.DEFAULT_BLOG_TYPE)
+        blog = Blog.objects.create(name='okok', owner=self.user)
+        blog.rate_blog(User.objects.create(username='rater'), 1)
+        self.assertIsNot(self.user.get_profile(), profile, msg='stale profile kept')
+        self.assertEqual(self.user.get_profile().blogs_rate, 1, msg='rate not reloaded')
+
+
+class CapabilitiesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.profile = Profile.objects.create(user=self.user)
+
+    def test_rate_threshold(self):
+        self.assertTrue(self.profile.check_access(Access.new_post), msg='access denied')
+        self.profile.rate = min(Access.get_thresholds().values()) - 1
+        self.assertFalse(
+            self.profile.check_access(Access.new_post),
+            msg='capabilities not recompiled on threshold crossing',
+        )
+
+    def test_permission_change(self):
+        self.assertFalse(self.profile.check_access('main.delete_post'), msg='wrong permission')
+        permission = Permission.objects.get(
+            codename='delete_post', content_type__app_label='main',
+        )
+        self.user.user_permissions.add(permission)
+        user = User.objects.get(id=self.user.id)
+        self.assertTrue(
+            Profile.objects.get(user=user).check_access('main.delete_post'),
+            msg='capabilities not invalidated on permission change',
+        )
+        permission.delete()
+        user = User.objects.get(id=self.user.id)
+        self.assertFalse(
+            Profile.objects.get(user=user).check_access('main.delete_post'),
+            msg='capabilities not invalidated on permission delete',
+        )
+
+
+class CommentCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.post = Post.objects.create(author=self.user, title='okok', text='eeee')
+        cache.delete(lastviews.LAST_VIEW_KEY % (self.user.id, self.post.id))
+        self.root = self.post.create_comment_root()
+
+    def _add_comment(self):
+        return self.root.add_child(
+            post=self.post, author=self.user, text='ok',
+            created=datetime.datetime.now(),
+        )
+
+    def test_counter(self):
+        comment = self._add_comment()
+        self._add_comment()
+        self.assertEqual(
+            Post.objects.get(id=self.post.id).comment_count, 2,
+            msg='comment count not incremented',
+        )
+        comment.delete()
+        self.assertEqual(
+            Post.objects.get(id=self.post.id).comment_count, 1,
+            msg='comment count not decremented',
+        )
+        Post.objects.update(comment_count=0)
+        Post.update_comment_count()
+        self.assertEqual(
+            Post.objects.get(id=self.post.id).comment_count, 1,
+            msg='comment count backfill broken',
+        )
+
+    def test_new_counts(self):
+        self._add_comment()
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual(
+            Post.get_new_comment_counts([post], self.user), {post.id: 1},
+            msg='not viewed post comments not new',
+        )
+        LastView.objects.create(post=post, user=self.user)
+        self.assertEqual(
+            Post.get_new_comment_counts([post], self.user), {post.id: 0},
+            msg='viewed comments counted as new',
+        )
+        LastView.objects.all().delete()
+        LastView.touch(self.user, post)
+        self.assertEqual(
+            Post.get_new_comment_counts([post], self.user), {post.id: 0},
+            msg='pending view not used',
+        )
+
+
+class TreeCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.post = Post.objects.create(author=self.user, title='okok', text='eeee')
+        self.root = self.post.create_comment_root()
+
+    def test_bump(self):
+        version = treecache.get_version(self.post.id)
+        comment = self.root.add_child(
+            post=self.post, author=self.user, text='ok',
+            created=datetime.datetime.now(),
+        )
+        self.assertNotEqual(
+            treecache.get_version(self.post.id), version,
+            msg='version not bumped on new comment',
+        )
+        version = treecache.get_version(self.post.id)
+        comment.rate_comment(User.objects.create(username='rater'), 1)
+        self.assertNotEqual(
+            treecache.get_version(self.post.id), version,
+            msg='version not bumped on comment rate',
+        )
+
+    def test_profile_save(self):
+        self.root.add_child(
+            post=self.post, author=self.user, text='ok',
+            created=datetime.datetime.now(),
+        )
+        version = treecache.get_version(self.post.id)
+        Profile.objects.create(user=self.user)
+        self.assertNotEqual(
+            treecache.get_version(self.post.id), version,
+            msg='version not bumped on commenter profile change',
+        )
+
+
+class ViewerStateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.post = Post.objects.create(author=self.user, title='okok', text='eeee')
+        cache.delete(lastviews.LAST_VIEW_KEY % (self.user.id, self.post.id))
+
+    def test_state(self):
+        Favourite.objects.create(post=self.post, user=self.user)
+        post = Post.get_with_viewer_state(self.post.id, self.user)
+        self.assertTrue(post.viewer_favourite, msg='favourite not loaded')
+        self.assertFalse(post.viewer_spy, msg='wrong spy')
+        self.assertIs(post.viewer_last_view, None, msg='wrong last view')
+
+    def test_touch(self):
+        self.assertIs(LastView.touch(self.user, self.post), None, msg='post viewed')
+        self.assertNotEqual(
+            LastView.touch(self.user, self.post), None,
+            msg='pending view not used',
+        )
+        lastviews.flush()
+        self.assertEqual(
+            LastView.objects.filter(user=self.user, post=self.post).count(), 1,
+            msg='view not flushed',
+        )
+        post = Post.get_with_viewer_state(self.post.id, self.user)
+        self.assertNotEqual(post.viewer_last_view, None, msg='last view not loaded')
+
+    def test_flush_own_dates(self):
+        other = Post.objects.create(author=self.user, title='okok', text='eeee')
+        LastView.touch(self.user, self.post)
+        seen = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(minutes=5)
+        cache.set(lastviews.LAST_VIEW_KEY % (self.user.id, self.post.id), seen)
+        LastView.touch(self.user, other)
+        lastviews.flush()
+        self.assertEqual(
+            LastView.objects.get(user=self.user, post=self.post).date, seen,
+            msg='view date of other pair written',
+        )
+
+
+class PathStepTest(TestCase):
+    def test_path_step(self):
+        self.assertEqual(path_step(1), '0001', msg='wrong path step')
+        self.assertEqual(path_step(37), '0011', msg='wrong path step')
+
+
+class PlaceholderTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.post = Post.objects.create(author=self.user, title='okok', text='eeee')
+        self.root = self.post.create_comment_root()
+        self.now = datetime.datetime.now()
+
+    def _add(self, parent, minutes):
+        return Comment.objects.get(id=parent.add_child(
+            post=self.post, author=self.user, text='ok',
+            created=self.now + datetime.timedelta(minutes=minutes),
+        ).id)
+
+    def test_placeholder(self):
+        first = self._add(self.root, 1)
+        answer = self._add(first, 2)
+        second = self._add(Comment.objects.get(id=self.root.id), 3)
+        late = self._add(Comment.objects.get(id=first.id), 4)
+        second = Comment.objects.get(id=second.id)
+        self.assertEqual(second.get_placceholder().id, answer.id, msg='wrong holder')
+        self.assertEqual(late.get_placceholder().id, answer.id, msg='wrong holder')
+        self.assertEqual(
+            Comment.get_placeholders([second, late, first]),
+            {second.id: answer.id, late.id: answer.id, first.id: self.root.id},
+            msg='batch holders not same as single',
+        )
+
+
+class BrokerTest(TestCase):
+    def test_wait(self):
+        broker = LocalBroker()
+        self.assertEqual(broker.wait(1, 0, timeout=0), 0, msg='wait not timed out')
+        broker.publish(1, 5)
+        self.assertEqual(broker.wait(1, 0, timeout=0), 5, msg='comment not published')
+        self.assertEqual(broker.wait(2, 0, timeout=0), 0, msg='wrong post notified')
+
+    def test_cache(self):
+        cache.delete(CacheBroker.key % (1,))
+        CacheBroker().publish(1, 5)
+        broker = CacheBroker()
+        self.assertEqual(broker.wait(1, 0, timeout=0), 5, msg='comment not shared')
+        self.assertEqual(broker.wait(1, 5, timeout=0), 5, msg='wait not timed out')
+        broker.publish(1, 3)
+        self.assertEqual(broker.last(1), 5, msg='older comment published')
+
+
+class SoftDeleteTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.post = Post.objects.create(author=self.user, title='okok', text='eeee')
+        root = self.post.create_comment_root()
+        self.comment = root.add_child(
+            post=self.post, author=self.user, text='ok',
+            created=datetime.datetime.now(),
+        )
+
+    def test_remove(self):
+        self.comment.remove()
+        self.assertTrue(
+            Comment.objects.filter(id=self.comment.id, is_removed=True).exists(),
+            msg='comment deleted instead of tombstoned',
+        )
+        self.assertEqual(
+            Post.objects.get(id=self.post.id).comment_count, 0,
+            msg='removed comment counted',
+        )
+        self.comment.restore()
+        self.assertEqual(
+            Post.objects.get(id=self.post.id).comment_count, 1,
+            msg='restored comment not counted',
+        )
+        self.comment.remove()
+        call_command('compactcomments', 10, 0)
+        self.assertFalse(
+            Comment.objects.filter(id=self.comment.id).exists(),
+            msg='removed comment not purged',
+        )
+        self.assertEqual(
+            Post.objects.get(id=self.post.id).comment_count, 0,
+            msg='purged comment counted twice',
+        )
+
+
+class CommentWindowTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.post = Post.objects.create(author=self.user, title='okok', text='eeee')
+        self.root = self.post.create_comment_root()
+        now = datetime.datetime.now()
+        self.branches = []
+        for num in range(3):
+            branch = Comment.objects.get(id=self.root.id).add_child(
+                post=self.post, author=self.user, text='branch',
+                created=now + datetime.timedelta(minutes=num * 2),
+            )
+            Comment.objects.get(id=branch.id).add_child(
+                post=self.post, author=self.user, text='answer',
+                created=now + datetime.timedelta(minutes=num * 2 + 1),
+            )
+            self.branches.append(branch.id)
+
+    def test_window(self):
+        comments, last = self.post.get_comment_window(budget=3)
+        self.assertEqual(len(comments), 2, msg='branch split or budget exceeded')
+        self.assertEqual(last, self.branches[0], msg='wrong last branch')
+        comments, last = self.post.get_comment_window(last, budget=4)
+        self.assertEqual(
+            [comment.id for comment in comments if comment.text == 'branch'],
+            self.branches[1:], msg='wrong next window',
+        )
+        self.assertIs(last, None, msg='end of tree not detected')
+
+    def test_bad_after(self):
+        answer = Comment.objects.filter(post=self.post, depth=3)[0]
+        for after in (answer.id, self.root.id, answer.id + 1000):
+            self.assertRaises(
+                Comment.DoesNotExist, self.post.get_comment_window, after,
+            )
+
+    def test_nodes(self):
+        comments, last = self.post.get_comment_window()
+        self.assertIs(comments[0].author, comments[1].author, msg='author not interned')
+        self.assertEqual(comments[1].get_parent_id(), comments[0].id, msg='wrong parent')
+        self.assertEqual(comments[1].get_margin(), 20, msg='wrong margin')
+        self.assertEqual(unicode(comments[1]), 'answer', msg='wrong text')
+
+
+class CountsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        Post.objects.create(author=self.user, title='okok', text='eeee')
+
+    def test_cached(self):
+        posts = counted(Post.objects.filter(author=self.user))
+        self.assertEqual(posts.count(), 1, msg='wrong count')
+        Post.objects.create(author=self.user, title='okok', text='eeee')
+        self.assertEqual(posts.count(), 2, msg='cached count not invalidated')
+        self.assertEqual(posts[:1].count(), 1, msg='slice counted by provider')
+
+    def test_joined_model(self):
+        posts = counted(Post.objects.filter(favourite__user=self.user), models=(Favourite,))
+        self.assertEqual(posts.count(), 0, msg='wrong count')
+        Favourite.objects.create(post=Post.objects.get(), user=self.user)
+        self.assertEqual(posts.count(), 1, msg='count not invalidated by joined table')
+
+    def test_version_expired(self):
+        posts = counted(Post.objects.filter(author=self.user))
+        self.assertEqual(posts.count(), 1, msg='wrong count')
+        cache.delete(counts._version_key(Post))
+        Post.objects.create(author=self.user, title='okok', text='eeee')
+        cache.delete(counts._version_key(Post))
+        self.assertEqual(posts.count(), 2, msg='count of expired version came back')
+
+    def test_modes(self):
+        for mode in (MODE_EXACT, MODE_ESTIMATED):
+            self.assertEqual(
+                counted(Post.objects.all(), mode).count(), 1,
+                msg='wrong %s count' % mode,
+            )
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.blog_type = BlogType.objects.create(name=settings.DEFAULT_BLOG_TYPE)
+        self.blog = Blog.objects.create(name='okok', owner=self.user, type=self.blog_type)
+
+    def _names(self, post):
+        return sorted(timelines.get_names(Post.objects.get(id=post.id)))
+
+    def test_fan_out(self):
+        post = Post.objects.create(author=self.user, blog=self.blog, title='okok', text='eeee', rate=1)
+        personal = Post.objects.create(author=self.user, title='okok', text='eeee')
+        self.assertEqual(
+            [item.id for item in timelines.TimelinePosts(timelines.blog_type_timeline(self.blog_type))[:10]],
+            [post.id], msg='post not in blog type timeline',
+        )
+        self.assertEqual(
+            [item.id for item in timelines.TimelinePosts(timelines.MAIN)[:10]],
+            [post.id], msg='post not in main timeline',
+        )
+        self.assertEqual(timelines.TimelinePosts(timelines.PERSONAL).count(), 1, msg='wrong personal count')
+        self.assertEqual(self._names(personal), [timelines.PERSONAL], msg='low rated post in main')
+
+    def test_hidden_type(self):
+        post = Post.objects.create(author=self.user, blog=self.blog, title='okok', text='eeee', rate=1)
+        self.blog_type.display_default = False
+        self.blog_type.save()
+        self.assertEqual(timelines.TimelinePosts(timelines.MAIN).count(), 0, msg='hidden post in main')
+        self.assertEqual(timelines.rebuild(), 1, msg='wrong rebuild count')
+        self.assertEqual(
+            self._names(post), [timelines.blog_type_timeline(self.blog_type)],
+            msg='wrong timelines after rebuild',
+        )
+
+
+class TagIndexTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.posts = []
+        for tags in ('python, django', 'python', 'django, web'):
+            post = Post.objects.create(author=self.user, title='okok', text='eeee')
+            tagindex.update_tags(post, tags)
+            self.posts.append(post.id)
+
+    def _ids(self, query):
+        return [post.id for post in tagindex.get_posts(query)[:10]]
+
+    def test_query(self):
+        self.assertEqual(self._ids('python+django'), self.posts[:1], msg='wrong and')
+        self.assertEqual(self._ids('python|web'), self.posts[::-1], msg='wrong or')
+        self.assertEqual(self._ids('nope'), [], msg='unknown tag matched')
+
+    def test_maintained(self):
+        tagindex.update_tags(Post.objects.get(id=self.posts[1]), 'web')
+        self.assertEqual(self._ids('python'), self.posts[:1], msg='old tag not removed')
+        Post.objects.get(id=self.posts[2]).delete()
+        self.assertEqual(self._ids('web'), self.posts[1:2], msg='deleted post in index')
+        cache.delete(tagindex._key('web'))
+        self.assertEqual(tagindex.get_ids('web'), self.posts[1:2], msg='index not same as in db')
+
+    def test_stale_list_not_saved(self):
+        stale = tagindex.get_ids('web')
+        post = Post.objects.create(author=self.user, title='okok', text='eeee')
+        tagindex.update_tags(post, 'web')
+        cache.set(tagindex._key('web'), stale)
+        tagindex.update_tags(Post.objects.get(id=self.posts[1]), 'web')
+        self.assertIn(post.id, tagindex.get_ids('web'), msg='concurrent update lost')
+
+
+class RelatedPostsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.posts = [
+            Post.objects.create(author=self.user, title='okok', text='eeee')
+            for num in range(3)
+        ]
+
+    def test_tokenize(self):
+        self.assertEqual(
+            related.tokenize(u'Django ORM', u'<p>fast <b>queries</b> a</p>', u'python, web'),
+            [u'django', u'orm', u'fast', u'queries', u'tag:python', u'tag:web'],
+            msg='wrong tokens',
+        )
+
+    def test_get_posts(self):
+        first, second, third = self.posts
+        related._write([(first.id, second.id, 0.2), (first.id, third.id, 0.7)])
+        self.assertEqual(
+            related.get_posts(first), [third, second], msg='wrong neighbours order',
+        )
+        self.assertEqual(related.get_posts(second), [], msg='neighbours of other post')
+
+
+    def test_skip_deleted(self):
+        first, second, third = self.posts
+        third_id = third.id
+        third.delete()
+        related._write([(first.id, second.id, 0.2), (first.id, third_id, 0.7)], [first.id])
+        self.assertEqual(related.get_posts(first), [second], msg='deleted post linked')
+
+
+@unittest.skipIf(numpy is None, 'needs numpy and scipy')
+class RelatedPostsBuildTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.dir = tempfile.mkdtemp()
+        self.path = related.RELATED_POSTS_PATH
+        related.RELATED_POSTS_PATH = os.path.join(self.dir, 'related.pickle')
+        related._index['mtime'] = None
+        self.orm, self.views, self.soup = [
+            self._post(title, text) for title, text in (
+                ('django orm', 'python queries'),
+                ('django views', 'python templates'),
+                ('soup', 'carrot onion'),
+            )
+        ]
+
+    def tearDown(self):
+        related.RELATED_POSTS_PATH = self.path
+        shutil.rmtree(self.dir)
+
+    def _post(self, title, text):
+        return Post.objects.create(author=self.user, title=title, text=text)
+
+    def test_build(self):
+        self.assertEqual(related.build(processes=1, count=1, chunk=2), 3, msg='not all posts built')
+        self.assertEqual(related.get_posts(self.orm), [self.views], msg='wrong neighbour')
+        self.assertEqual(related.get_posts(self.soup), [], msg='unrelated post linked')
+
+    def test_score_new(self):
+        self.assertEqual(related.score_new(), None, msg='scored without index')
+        related.build(processes=1, count=1)
+        self.views.delete()
+        new = self._post('django orm', 'python views')
+        self.assertEqual(related.score_new(count=2), 1, msg='new post not scored')
+        self.assertEqual(related.get_posts(new), [self.orm], msg='wrong neighbours of new post')
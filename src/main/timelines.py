@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+
+
+POST_RATE_TO_MAIN = getattr(settings, 'POST_RATE_TO_MAIN', 0)
+MAIN = 'main'
+PERSONAL = 'pers'
+
+
+def blog_type_timeline(blog_type):
+    """Get name of timeline of BlogType"""
+    return 'type_%d' % (getattr(blog_type, 'id', blog_type),)
+
+
+def get_names(post):
+    """Get names of timelines post belongs to"""
+    names = []
+    blog = post.blog
+    if blog is None:
+        names.append(PERSONAL)
+    else:
+        names.append(blog_type_timeline(blog.type_id))
+    if post.rate > POST_RATE_TO_MAIN and (blog is None or blog.type.display_default):
+        names.append(MAIN)
+    return names
+
+
+def update_post(post):
+    """Put post to its timelines and remove from others
+
+    Keyword arguments:
+    post -- Post
+
+    Returns: None
+    """
+    from main.models import Timeline
+    names = set(get_names(post))
+    entries = Timeline.objects.filter(post=post)
+    entries.exclude(name__in=names).delete()
+    entries.filter(name__in=names).exclude(pinch=post.pinch).update(pinch=post.pinch)
+    for name in names - set(entries.values_list('name', flat=True)):
+        Timeline.objects.create(name=name, post=post, pinch=post.pinch)
+
+
+def update_blog(blog):
+    """Move posts of blog after blog type changes"""
+    for post in blog.post_set.select_related('blog', 'blog__type'):
+        update_post(post)
+
+
+def rebuild():
+    """Fill timelines from posts table
+
+    Returns: Integer
+    """
+    from main.models import Post, Timeline
+    Timeline.objects.all().delete()
+    count = 0
+    for post in Post.objects.select_related('blog', 'blog__type').iterator():
+        update_post(post)
+        count += 1
+    return count
+
+
+def on_post_save(instance, **kwargs):
+    update_post(instance)
+
+
+def on_blog_save(instance, created, **kwargs):
+    if not created:
+        update_blog(instance)
+
+
+def on_blog_type_save(instance, created, **kwargs):
+    if not created:
+        for blog in instance.get_blogs():
+            update_blog(blog)
+
+
+class TimelinePosts(object):
+    """Lazy list of timeline posts for paginators
+
+    Slice reads range of timeline index and fetches posts by primary key.
+    """
+
+    def __init__(self, name, pinned=True):
+        from main.models import Timeline
+        from main.counts import counted
+        self.entries = counted(Timeline.objects.filter(name=name).order_by(
+            *(('-pinch', '-post') if pinned else ('-post',))
+        ))
+
+    def count(self):
+        return self.entries.count()
+
+    def __len__(self):
+        return self.count()
+
+    def _get_ids(self, key):
+        return list(self.entries.values_list('post', flat=True)[key])
+
+    def __getitem__(self, key):
+        from main.models import Post
+        if isinstance(key, slice):
+            ids = self._get_ids(key)
+            posts = Post.objects.select_related(
+                'author', 'blog', 'author__profile',
+            ).in_bulk(ids)
+            return [posts[id] for id in ids if id in posts]
+        return self[key:key + 1][0]
+
+    def __iter__(self):
+        return iter(self[:])
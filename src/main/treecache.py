@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+from django.conf import settings
+from main.utils import get_version as _get_version, bump_version
+
+
+COMMENT_TREE_TIME = getattr(settings, 'COMMENT_TREE_TIME', 24 * 60 * 60)
+
+
+def _version_key(post_id):
+    return 'main_comment_tree_version_%d' % (post_id,)
+
+
+def get_version(post_id):
+    """Get version of rendered comment tree of post"""
+    return _get_version(_version_key(post_id), COMMENT_TREE_TIME)
+
+
+def bump(post_id):
+    """Make cached comment tree of post stale"""
+    bump_version(_version_key(post_id), COMMENT_TREE_TIME)
+
+
+def on_comment_change(instance, **kwargs):
+    bump(instance.post_id)
+
+
+def on_post_save(instance, **kwargs):
+    bump(instance.id)
+
+
+def on_profile_save(instance, **kwargs):
+    """Trees show avatars and names of commenters"""
+    from main.models import Comment
+    for post_id in Comment.objects.filter(
+        author=instance.user_id,
+    ).values_list('post', flat=True).distinct():
+        bump(post_id)
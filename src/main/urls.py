@@ -40,6 +40,8 @@ urlpatterns = patterns('djang0byte.main.views',
   ('^action/preview_comment/$', 'preview_comment'),
   ('^action/post_options/(\d*)/$', 'post_options'),
   ('^action/get_last_comments/(\d*)/$', 'get_last_comments'),
+  ('^action/wait_comments/(\d*)/(\d*)/$', 'wait_comments'),
+  ('^action/get_comment_branches/(\d+)/(\d+)/$', 'get_comment_branches'),
   ('^action/mark_solved/(\d*)/(\d*)/$', 'mark_solved'),
   ('^action/set_right_answer/(\d*)/(\d*)/(\d*)/$', 'set_right_answer'),
   ('^action/get_raters/(\w*)/(\d*)/$', 'get_raters'),
@@ -16,9 +16,10 @@
 from django import forms
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.mail import send_mail
 from django.http import HttpResponse
-from django.template.loader import render_to_string
+from django.template.loader import render_to_string, get_template
 from pytils.translit import slugify, translify
 from time import strftime
 import urllib
@@ -27,6 +28,9 @@ import simplejson
 from django.utils.translation import ugettext as _
 import pytz
 from datetime import datetime
+from bisect import bisect_right
+from uuid import uuid4
+import time
 
 def jsend(data):
     """Alias for sending 'jsoned' data"""
@@ -97,6 +101,129 @@ def new_notify_email(comment, type, recipient):
         pass #fail silently
 
 
+def render_each(template_name, objects, context, name='object'):
+    """Render template for every object with one compiled template
+
+    Keyword arguments:
+    template_name -- String
+    objects -- list
+    context -- Context, built once for all objects
+    name -- String, context variable for object
+
+    Returns: list of unicode
+    """
+    template = get_template(template_name)
+    result = []
+    context.push()
+    try:
+        for obj in objects:
+            context[name] = obj
+            result.append(template.render(context))
+    finally:
+        context.pop()
+    return result
+
+
+class LazyValue(object):
+    """Value computed on first access from template and memoized"""
+
+    def __init__(self, fnc, *args, **kwargs):
+        self.fnc = fnc
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self):
+        if not hasattr(self, '_value'):
+            self._value = self.fnc(*self.args, **self.kwargs)
+        return self._value
+
+
+def get_version(key, timeout):
+    """Get version token stored in cache, new token if missing
+
+    Tokens are random, so entries stored under expired version never
+    come back after the version key expires.
+    """
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        if not cache.add(key, version, timeout):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(key, timeout):
+    """Make all entries stored under version from key unused"""
+    cache.set(key, uuid4().hex, timeout)
+
+
+class CacheLog(object):
+    """Numbered log in cache, shared by all workers and read in order by flush
+
+    Keyword arguments:
+    prefix -- String, prefix of cache keys
+    timeout -- Integer, lifetime of entries
+    """
+
+    def __init__(self, prefix, timeout):
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def _key(self, name):
+        return '%s_%s' % (self.prefix, name)
+
+    def append(self, value):
+        seq = self._key('seq')
+        cache.add(seq, 0, self.timeout)
+        try:
+            num = cache.incr(seq)
+        except ValueError:
+            cache.set(seq, 1, self.timeout)
+            num = 1
+        cache.set(self._key(num), value, self.timeout)
+
+    def flush(self, write, wait):
+        """Pass values appended since last flush to write
+
+        Entry with number taken but value not set yet stops the flush,
+        it is skipped when still missing after wait seconds.
+
+        Keyword arguments:
+        write -- callable, gets list of values
+        wait -- Integer, seconds
+
+        Returns: False when log flushed by other worker
+        """
+        lock = self._key('lock')
+        if not cache.add(lock, 1, wait):
+            return False
+        try:
+            last = cache.get(self._key('seq'), 0)
+            flushed = cache.get(self._key('flushed'), 0)
+            if flushed > last:
+                # sequence expired and started again
+                flushed = 0
+            keys = [self._key(num) for num in range(flushed + 1, last + 1)]
+            entries = cache.get_many(keys)
+            values = []
+            for key in keys:
+                if key in entries:
+                    values.append(entries[key])
+                else:
+                    missing = cache.get(self._key('missing'))
+                    if missing is None or missing[0] != key:
+                        cache.set(self._key('missing'), (key, time.time()), self.timeout)
+                        break
+                    if time.time() - missing[1] < wait:
+                        break
+                flushed += 1
+            write(values)
+            cache.set(self._key('flushed'), flushed, self.timeout)
+        finally:
+            cache.delete(lock)
+        return True
+
+
 class Access(object):
     new_post = 0
     new_blog = 1
@@ -106,6 +233,71 @@ class Access(object):
     rate_user = 5
     rate_blog = 6
 
+    # django permissions compiled to capabilities after rate based bits
+    PERMISSIONS = (
+        'main.delete_post', 'main.change_post',
+        'main.delete_comment', 'main.change_comment',
+        'main.delete_blog', 'main.change_blog',
+    )
+    CAPABILITIES_TIME = getattr(settings, 'CAPABILITIES_TIME', 24 * 60 * 60)
+
+    @staticmethod
+    def get_thresholds():
+        """Get minimal rate for each access type"""
+        return {
+            Access.new_post: settings.NEWPOST_RATE,
+            Access.new_blog: settings.NEWBLOG_RATE,
+            Access.new_comment: settings.NEWCOMMENT_RATE,
+            Access.rate_post: settings.RATEPOST_RATE,
+            Access.rate_comment: settings.RATECOM_RATE,
+            Access.rate_user: settings.RATEUSER_RATE,
+            Access.rate_blog: settings.RATEBLOG_RATE,
+        }
+
+    @staticmethod
+    def bit(type):
+        """Get bit of access type or permission name"""
+        if type in Access.PERMISSIONS:
+            return 1 << (Access.rate_blog + 1 + Access.PERMISSIONS.index(type))
+        return 1 << type
+
+    @staticmethod
+    def get_level(rate):
+        """Get number of rate thresholds passed"""
+        return bisect_right(sorted(set(Access.get_thresholds().values())), rate)
+
+    @staticmethod
+    def compile(rate, user):
+        """Compile rate based access and user permissions to bitmask
+
+        Keyword arguments:
+        rate -- Float
+        user -- User
+
+        Returns: Integer
+        """
+        mask = 0
+        for type, threshold in Access.get_thresholds().items():
+            if rate >= threshold:
+                mask |= Access.bit(type)
+        for perm in Access.PERMISSIONS:
+            if user.has_perm(perm):
+                mask |= Access.bit(perm)
+        return mask
+
+    @staticmethod
+    def cache_key(user_id):
+        version = get_version('main_capabilities_version', Access.CAPABILITIES_TIME)
+        return 'main_capabilities_%s_%d' % (version, user_id)
+
+    @staticmethod
+    def invalidate(user_id=None):
+        """Drop cached capabilities of user or of all users"""
+        if user_id is None:
+            bump_version('main_capabilities_version', Access.CAPABILITIES_TIME)
+        else:
+            cache.delete(Access.cache_key(user_id))
+
 
 RATE_PLUS = '1'
 RATE_MINUS = '0'
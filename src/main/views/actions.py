@@ -16,18 +16,20 @@
 from django.db import transaction
 from django.contrib import auth
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template.loader import render_to_string
 from main.forms import *
 from main.models import *
 from djang0parser.utils import unparse, unparse, remove_code
-from settings import POST_RATE_COEFFICIENT, BLOG_RATE_COEFFICIENT, COMMENT_RATE_COEFFICIENT, VALID_TAGS, VALID_ATTRS
+from settings import VALID_TAGS, VALID_ATTRS
 from django.views.decorators.cache import cache_page, never_cache
 from simplepagination import paginate
 from annoying.decorators import render_to
 from tagging.models import TaggedItem
-from main.utils import Access, jsend, RATE
+from main.utils import Access, jsend, RATE, render_each
+from main import leaderboard, activity, identity
+from main.broker import broker, get_wait_timeout, COMMENT_POLL_INTERVAL
 from djang0parser import utils
 from django.template import RequestContext
 from settings import DEFAULT_CACHE_TIME
@@ -36,6 +38,7 @@ from django.utils import simplejson
 from django.utils.translation import gettext as _
 from annoying.decorators import ajax_request
 import simplejson as json
+import datetime
 from django.conf import settings
 from django.core.urlresolvers import reverse
 
@@ -128,7 +131,7 @@ def rate_blog(request, profile, blog_id, json, action):
     Returns: HttpResponse
 
     """
-    blog = Blog.objects.get(id=blog_id)
+    blog = identity.get(Blog, id=blog_id)
     if request.user != blog.owner:
         if profile.check_access(Access.rate_blog):
             rate = blog.rate_blog(request.user, RATE[action])
@@ -183,7 +186,7 @@ def action(request, type, id, action = None):#TODO: Split and rewrite this shit!
         post = Post.objects.select_related('author').get(id=id)
     except Post.DoesNotExist:
         post = Post()
-    profile = Profile.objects.get(user=request.user)
+    profile = request.user.get_profile()
     if type == 'ratecom':
         return(rate_comment(request, profile, id, json, action))
     elif type == 'rateblog' and profile.check_access(Access.rate_blog):
@@ -226,6 +229,15 @@ def action(request, type, id, action = None):#TODO: Split and rewrite this shit!
 
     return HttpResponseRedirect('/post/%d/' % (int(id)))
 
+def serialize_activity(entry):
+    """Get panel item from activity entry"""
+    return {
+        'title': entry['title'],
+        'url': entry['url'],
+        'rate': entry['rate'],
+        'type': entry['type'],
+    }
+
 @never_cache
 def get_val(request, type, count=20):
     out = []
@@ -236,56 +248,26 @@ def get_val(request, type, count=20):
         pass
     if type == 'comments':
         request.session['right_panel'] = type
-        comments = Comment.objects.exclude(depth=1).select_related('post', 'post.blog', 'post.author').order_by('-id')[
-                   :count]
-        for comment in comments:
-            out.append({
-                'title': u"%s / %s &ndash; %s" % (
-                    comment.author.username,
-                    comment.post.blog and comment.post.blog.name or comment.post.author.username,
-                    comment.post.title,
-                ),
-                'url': "/post/%d/#cmnt%d" % (
-                    comment.post.id,
-                    comment.id,
-                ),
-                'rate': comment.rate,
-                'type': 'comment',
-            })
+        out = map(serialize_activity, activity.get(activity.TYPE_COMMENT, int(count)))
     elif type == 'posts':
         request.session['right_panel'] = type
-        posts = Post.objects.select_related('blog', 'author').order_by('-id')[:count]
-        for post in posts:
-            out.append({
-                'title': u"%s &ndash; %s" % (
-                    post.blog and post.blog.name or post.author.username,
-                    post.title,
-                ),
-                'url': '/post/%d/' % (post.id,),
-                'rate': post.rate,
-                'type': 'post',
-            })
+        out = map(serialize_activity, activity.get(activity.TYPE_POST, int(count)))
     elif type == 'users':
         request.session['right_panel_2'] = 'users'
-        users = Profile.objects.select_related('user').extra(select={'fullrate':
-            "rate+%f*posts_rate+%f*blogs_rate+%f*comments_rate"
-            % (POST_RATE_COEFFICIENT, BLOG_RATE_COEFFICIENT, COMMENT_RATE_COEFFICIENT), },
-            order_by=['-fullrate',])[:count]
-        for user in users:
+        for user in leaderboard.users.get(int(count)):
             out.append({
-                'title': user.user.username,
-                'url': '/user/%s/' % (user.user.username,),
-                'rate': user.get_rate(),
+                'title': user['username'],
+                'url': '/user/%s/' % (user['username'],),
+                'rate': user['fullrate'],
                 'type': 'user',
             })
     elif type == 'blogs':
         request.session['right_panel_2'] = 'blogs'
-        blogs = Blog.objects.order_by('-rate')[:count]
-        for blog in blogs:
+        for blog in leaderboard.blogs.get(int(count)):
             out.append({
-                'title': blog.name,
-                'url': "/blog/%d/" % (blog.id,),
-                'rate': blog.rate,
+                'title': blog['name'],
+                'url': "/blog/%d/" % (blog['id'],),
+                'rate': blog['rate'],
                 'type': 'blog',
             })
     elif type == 'favourites':
@@ -336,44 +318,100 @@ def get_val(request, type, count=20):
 @login_required
 def get_last_comments(request, post, comment_id = None):
     post = Post.objects.get(id=post)
-    try:
-        last_view = LastView.objects.get(post=post, user=request.user)
-        last_view_date = last_view.date
-        last_view.update()
-    except:
-        last_view = LastView(post=post, user=request.user)
-        last_view_date = 1
-        last_view.save()
-    comments = Comment.objects.filter(created__gt=last_view_date, post=post).order_by('created')
+    last_view_date = LastView.touch(request.user, post) or 1
+    comments = list(Comment.objects.filter(
+        created__gt=last_view_date, post=post,
+    ).select_related('author').order_by('created'))
+    placeholders = Comment.get_placeholders(comments)
+    contents = render_each('single_comment.html', comments, RequestContext(request, {
+        'post': post,
+        'all_new': True,
+    }), 'comment')
     return jsend({
         'comments': [{
-            'content': render_to_string('single_comment.html', {
-                'post': post,
-                'comment': comment,
-                'last_view': last_view_date,
-            }, RequestContext(request)),
-            'placeholder': comment.get_placceholder().id,
+            'content': content,
+            'placeholder': placeholders[comment.id],
             'id': comment.id,
             'own': comment_id == comment.id,
-        } for comment in comments],
-        'count': comments.count(),
+        } for comment, content in zip(comments, contents)],
+        'count': len(comments),
+    })
+
+
+@never_cache
+def get_comment_branches(request, post, after):
+    """Get next window of comments tree
+
+    Keyword arguments:
+    request -- request object
+    post -- Integer
+    after -- Integer, id of last shown top level comment
+
+    GET since -- timestamp of reader last view, comments created after
+    it returned in new, all new if 0
+
+    Returns: HttpResponse
+    """
+    post = get_object_or_404(Post, id=post)
+    try:
+        comments, last = post.get_comment_window(int(after))
+    except Comment.DoesNotExist:
+        raise Http404
+    try:
+        since = datetime.datetime.fromtimestamp(float(request.GET['since']))
+    except (KeyError, ValueError):
+        new = []
+    else:
+        new = [comment.id for comment in comments if comment.created > since]
+    return jsend({
+        'new': new,
+        'comments': render_each('single_comment.html', comments, RequestContext(request, {
+            'post': post,
+            'right_answer': post.right_answer,
+            'is_qa': post.blog.type.is_qa if post.blog is not None else False,
+        }), 'comment'),
+        'last': last,
+    })
+
+
+@never_cache
+def wait_comments(request, post, since):
+    """Long-poll until new comment in post, no db queries while waiting
+
+    Waits only when served by push.py greenlets, sync workers answer
+    at once and tell client when to ask again.
+
+    Keyword arguments:
+    request -- request object
+    post -- Integer
+    since -- Integer, last comment id known by reader
+
+    Returns: HttpResponse
+    """
+    timeout = get_wait_timeout()
+    return jsend({
+        'last': broker.wait(int(post), int(since), timeout),
+        'retry': 0 if timeout else COMMENT_POLL_INTERVAL,
     })
 
 
 @never_cache
 def get_users(request, users):
     out = []
-    for username in users.split(','):
+    users = users.split(',')
+    found = identity.get_many(User, users, 'username')
+    profiles = identity.get_many(Profile, found.values(), 'user')
+    for username in users:
         try:
-            user = User.objects.get(username=username)
-            profile = user.get_profile()
+            user = found[username]
+            profile = profiles[user.id]
             out.append({
                 'name': username,
                 'is_active': user.is_active,
                 'avatar': profile.get_avatar(),
                 'rate': profile.get_rate(),
             })
-        except User.DoesNotExist:
+        except KeyError:
             pass
     return jsend(out)
 
@@ -384,7 +422,7 @@ def post_options(request, id):
     extend = 'base.html'
     if request.GET.get('json', 0):
         extend = 'json.html'
-    if not request.user.has_perm('main.delete_post'):
+    if not request.user.get_profile().check_access('main.delete_post'):
         return {}
     post = Post.objects.get(id=id)
     if request.method == 'POST':
@@ -416,7 +454,7 @@ def delete_post(request, id):
     extend = 'base.html'
     if request.GET.get('json', 0):
         extend = 'json.html'
-    if request.user.has_perm('main.delete_post'):
+    if request.user.get_profile().check_access('main.delete_post'):
         post = Post.objects.get(id=id)
         if request.POST.get('yes'):
             post.delete()
@@ -435,11 +473,12 @@ def delete_comment(request, id):
     extend = 'base.html'
     if request.GET.get('json', 0):
         extend = 'json.html'
-    if request.user.has_perm('main.delete_comment'):
+    if request.user.get_profile().check_access('main.delete_comment'):
         comment = Comment.objects.select_related('post').get(id=id)
         if request.POST.get('yes'):
             post = comment.post
-            comment.delete()
+            if not comment.is_removed:
+                comment.remove()
             return HttpResponseRedirect('/post/%d/' % (post.id,))
         elif not request.POST.get('no'):
             return {
@@ -460,7 +499,7 @@ def edit_comment(request, id):
 
     Returns: HttpResponse
     """
-    if request.user.has_perm('main.change_comment'):
+    if request.user.get_profile().check_access('main.change_comment'):
         comment = Comment.objects.select_related('post').get(id=id)
         if request.method == 'POST':
             form = CreateCommentForm(request.POST)
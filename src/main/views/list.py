@@ -22,10 +22,10 @@ from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseRedirect
 from django.shortcuts import render_to_response
 from main.models import *
+from main.counts import counted
 from django.views.decorators.cache import cache_page
 from simplepagination import paginate
 from annoying.decorators import render_to
-from settings import POST_RATE_COEFFICIENT, BLOG_RATE_COEFFICIENT, COMMENT_RATE_COEFFICIENT
 from django.utils.translation import ugettext as _
 
 @cache_page(0)
@@ -54,15 +54,9 @@ def list_users(request, order = None, param = None, param_value = None):
         items = Profile.objects.select_related('user')
         url = '/list/users/'
     if order == 'rate':
-        items = items.extra(select={'fullrate':
-                'rate+%f*posts_rate+%f*blogs_rate+%f*comments_rate'
-                % (POST_RATE_COEFFICIENT, BLOG_RATE_COEFFICIENT, COMMENT_RATE_COEFFICIENT), },
-                order_by=['fullrate',])
+        items = items.order_by('fullrate')
     elif order == 'rate_desc':
-        items = items.extra(select={'fullrate':
-               'rate+%f*posts_rate+%f*blogs_rate+%f*comments_rate'
-                % (POST_RATE_COEFFICIENT, BLOG_RATE_COEFFICIENT, COMMENT_RATE_COEFFICIENT), },
-                order_by=['-fullrate',])
+        items = items.order_by('-fullrate')
     elif order == 'name_desc':
         items = items.order_by('-user__username')
     else:
@@ -83,7 +77,7 @@ def list_users(request, order = None, param = None, param_value = None):
             }
         ]
     return({
-        'object_list': items,
+        'object_list': counted(items),
         'type': 'users',
         'param': param,
         "map": map,
@@ -123,7 +117,7 @@ def list_blogs(request, order = None, param = None, param_value = None):
     else:
         url = '/list/blogs/'
     return({
-        'object_list': blogs,
+        'object_list': counted(blogs),
         'type': 'blogs',
         'param': param,
         'param_value': param_value,
@@ -27,11 +27,17 @@ from annoying.decorators import render_to
 from tagging.models import TaggedItem
 from django.template import RequestContext
 from actions import  get_last_comments
+from main import treecache
+from main.broker import broker
+from main import timelines, tagindex, related
+from main.counts import counted, MODE_ESTIMATED
+from main.utils import LazyValue
 from settings import DEFAULT_CACHE_TIME, POST_RATE_TO_MAIN, FULLNAME, FEED_URL
 from django.views.decorators.vary import vary_on_cookie
 from django.utils.translation import ugettext as _
 from haystack.query import SearchQuerySet
 from xapian_backend import InvalidIndexError
+import time
 
 @never_cache
 @login_required
@@ -136,39 +142,36 @@ def post(request, id):
     Returns: HttpResponse
 
     """
-    post = get_object_or_404(Post, id=id)
+    try:
+        post = Post.get_with_viewer_state(id, request.user)
+    except Post.DoesNotExist:
+        raise Http404
     author = post.author.get_profile()
-    comments = post.get_comment()
+    comments = LazyValue(post.get_comment_window)
     form = CreateCommentForm({'post': id, 'comment': 0})
     post.get_content = post.get_full_content
     post.is_answer(request.user)
     options = {}
-    last_view_date = None
+    new_comments = None
+    all_comments_new = False
+    last_comment_id = None
+    comments_since = ''
     if request.user.is_authenticated():
-        try:
-            try:
-                options['favourite'] = Favourite.objects.get(post=post, user=request.user)
-            except Favourite.DoesNotExist:
-                options['favourite'] = False
-        except MultipleObjectsReturned:
-            Favourite.objects.filter(post=post, user=request.user).delete()
-            options['favourite'] = False
-        try:
-            try:
-                options['spy'] = Spy.objects.get(post=post, user=request.user)
-            except Spy.DoesNotExist:
-                options['spy'] = False
-        except MultipleObjectsReturned:
-            Spy.objects.filter(post=post, user=request.user).delete() #shit, but work
-            options['spy'] = False
-        try:
-            last_view = LastView.objects.get(post=post, user=request.user)
-            last_view_date = last_view.date
-            last_view.update()
-        except:
-            last_view = LastView(post=post, user=request.user)
-            last_view_date = 1
-            last_view.save()
+        last_comment_id = broker.last(post.id)
+        options['favourite'] = bool(post.viewer_favourite)
+        options['spy'] = bool(post.viewer_spy)
+        last_view_date = LastView.touch(request.user, post)
+        if last_view_date is None:
+            all_comments_new = True
+            comments_since = '0'
+        else:
+            comments_since = '%.6f' % (
+                time.mktime(last_view_date.timetuple())
+                + last_view_date.microsecond / 1e6,
+            )
+            new_comments = Comment.objects.filter(
+                post=post, depth__gt=1, created__gt=last_view_date,
+            ).values_list('id', flat=True)
     return({
         'post': post,
         'author': author,
@@ -176,10 +179,17 @@ def post(request, id):
         'comment_form': form,
         "options": options,
         'single': True,
-        'PERM_EDIT_POST': post.type < 3 and (
-            request.user.has_perm('main.change_post') or request.user == post.author
-        ),
-        'last_view': last_view_date,
+        'PERM_EDIT_POST': post.type < 3 and (request.user == post.author or (
+            request.user.is_authenticated()
+            and request.user.get_profile().check_access('main.change_post')
+        )),
+        'new_comments': new_comments,
+        'all_comments_new': all_comments_new,
+        'last_comment_id': last_comment_id,
+        'comments_since': comments_since,
+        'comments_version': treecache.get_version(post.id),
+        'comment_tree_time': treecache.COMMENT_TREE_TIME,
+        'is_post_author': request.user == post.author,
         'is_qa': post.blog.type.is_qa if post.blog is not None else False,
         'right_answer': post.right_answer,
     })
@@ -200,28 +210,28 @@ def post_list(request, post_type = None, param = None):
 
     """
     posts = None
+    count_models = (Blog, BlogType)
     subject = None
     option = None
     rss = FEED_URL
     is_qa = False
     if not post_type:
         title = FULLNAME
-        blog_types = BlogType.objects.filter(display_default=False)
-        blogs = Blog.objects.filter(type__in=blog_types)
-        posts = Post.objects.exclude(blog__in=blogs).filter(rate__gt=POST_RATE_TO_MAIN)
+        posts = timelines.TimelinePosts(timelines.MAIN)
     elif BlogType.check(post_type):
         blog_type = BlogType.objects.get(name=post_type)
         is_qa = blog_type.is_qa
         title = blog_type.name
-        posts = Post.objects.filter(blog__in=blog_type.get_blogs())
         if param == 'solved':
-            posts = posts.filter(solved=True)
+            posts = Post.objects.filter(blog__type=blog_type, solved=True)
         elif param == 'unsolved':
-            posts = posts.filter(solved=False)
+            posts = Post.objects.filter(blog__type=blog_type, solved=False)
+        else:
+            posts = timelines.TimelinePosts(timelines.blog_type_timeline(blog_type))
         rss = '/rss/%s/' % (post_type)
     elif post_type == 'pers':
         title = _('Presonal posts')
-        posts = Post.objects.filter(blog=None)
+        posts = timelines.TimelinePosts(timelines.PERSONAL)
     elif post_type == 'blog':
         blog = Blog.objects.get(id=param)
         title = _('Blog in %s') % blog.name
@@ -231,7 +241,7 @@ def post_list(request, post_type = None, param = None):
         rss = '/rss/blog/%s/' % (param)
     elif post_type == 'tag':
         title = _(u'Posts with tag %s') % unicode(param)
-        posts = TaggedItem.objects.get_by_model(Post, param)
+        posts = tagindex.get_posts(param)
         subject = param
         rss = '/rss/tag/%s/' % (param)
         #posts = [post.post for post in posts_with_tag]
@@ -245,18 +255,21 @@ def post_list(request, post_type = None, param = None):
         rss = '/rss/auth/%s/' % (param)
     elif post_type == 'like':
         post = Post.objects.get(id=param)
-        posts = TaggedItem.objects.get_related(post, Post)
+        posts = related.get_posts(post) or TaggedItem.objects.get_related(post, Post)
         title = _(u'Posts like %s') % (post.title)
         subject = post
     elif post_type == 'favourite':
         title = _('Favourite posts')
         #TODO: rewrite favorite to ManyToMany
         posts = Post.objects.filter(favourite__user=request.user)
+        count_models += (Favourite,)
     else:
         # Do not crash on unknown type
         raise Http404(_('Address not found: %s') % post_type)
-    if posts and type(posts) not in (imap, list):
-        posts = posts.order_by('-pinch', '-id').select_related('author', 'blog', 'author__profile')
+    if posts is not None and not isinstance(posts, (imap, list, timelines.TimelinePosts)):
+        posts = counted(posts.order_by('-pinch', '-id').select_related(
+            'author', 'blog', 'author__profile',
+        ), models=count_models)
     #TODO: fix answer result in post list
     return {
         'object_list': posts,
@@ -312,6 +325,7 @@ def new_comment(request, post=0, comment=0):
                 created=datetime.datetime.now()
             )
             comment.save()
+            broker.publish(comment.post_id, comment.id)
             if request.user not in (data['root'].author, comment.post.author):
                 Notify.new_comment_notify(comment)
             for mention in utils.find_mentions(data['raw_text']):
@@ -353,6 +367,7 @@ def lenta(request):
         'post', 'comment', 'post__author', 'comment__author',
         'post__author__profile', 'comment__author__profile',
     ).filter(user=request.user).order_by("-id")
+    notifs = counted(notifs)
     LentaLastView.update_last_view(request.user)
     return {
         'object_list': notifs
@@ -371,7 +386,7 @@ def search(request):
         return {
             'form': form,
             'query': '',
-            'object_list': Post.objects.all(),
+            'object_list': counted(Post.objects.all(), MODE_ESTIMATED),
         }
     q = lambda attr: models.Q(**{attr: form.cleaned_data['query']})#SHIT
     return {
@@ -25,6 +25,7 @@ from django.views.decorators.cache import never_cache
 from loginza.models import UserMap
 from main.forms import LoginForm, RegisterForm, EditUserForm, EditUserPick, EditUserPick
 from main.models import *
+from main.counts import counted
 from django.db import transaction
 from urlparse import urlparse
 from django.template.context import RequestContext
@@ -308,9 +309,9 @@ def comments(request, user):
 
     """
     user = get_object_or_404(User, username=user)
-    comments = Comment.objects.filter(author=user).order_by('-created')
+    comments = Comment.objects.filter(author=user, is_removed=False).order_by('-created')
     return {
         'user': user,
-        'object_list': comments,
+        'object_list': counted(comments),
         'profile': user.get_profile()
     }
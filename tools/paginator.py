@@ -1,6 +1,10 @@
 from tools.shortcuts import to_json
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import simplejson
 from functools import wraps
+import base64
 
 
 class Paginated(object):
@@ -54,10 +58,108 @@ class Paginated(object):
             yield item
 
 
-def paginated_json(fnc):
-    """Return paginated json"""
-    @wraps(fnc)
-    def wrapper(request, page=0, *args, **kwargs):
-        result = fnc(request, page, *args, **kwargs)
-        return to_json(Paginated(result, page))
-    return wrapper
+class CursorPaginated(object):
+    """Keyset paginator, seeks on (key, id) instead of offset and count
+
+    Cursors are opaque strings, "has next" known by fetching one more row.
+    """
+    json_fields = (
+        ('content', 'content_json'), 'next_cursor', 'prev_cursor',
+        'next_page_available', 'prev_page_available',
+    )
+
+    def __init__(self, qs, cursor=None, per_page=getattr(settings, 'PER_PAGE', 10), key='-id'):
+        self.qs = qs
+        self.per_page = int(per_page)
+        self.desc = key.startswith('-')
+        self.field = key.lstrip('-')
+        self.backward = False
+        self.position = None
+        if cursor:
+            decoded = self.decode(cursor, qs.model._meta.get_field(self.field))
+            if decoded is not None:
+                self.backward, value, id = decoded
+                self.position = (value, id)
+
+    @staticmethod
+    def decode(cursor, field):
+        """Get (backward, value, id) from cursor, None if cursor is broken"""
+        try:
+            backward, value, id = simplejson.loads(base64.urlsafe_b64decode(str(cursor)))
+            value = field.to_python(value)
+        except (TypeError, ValueError, ValidationError):
+            return None
+        if not isinstance(backward, bool) or not isinstance(id, (int, long))\
+                or isinstance(id, bool) or value is None:
+            return None
+        return backward, value, id
+
+    def encode(self, obj, backward):
+        value = getattr(obj, self.field)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat(' ')
+        return base64.urlsafe_b64encode(simplejson.dumps((backward, value, obj.id)))
+
+    def _seek(self, qs, desc):
+        value, id = self.position
+        lookup = 'lt' if desc else 'gt'
+        return qs.filter(
+            Q(**{'%s__%s' % (self.field, lookup): value})
+            | Q(**{self.field: value, 'id__%s' % lookup: id})
+        )
+
+    @property
+    def content(self):
+        if not hasattr(self, '_content'):
+            desc = self.desc != self.backward
+            prefix = '-' if desc else ''
+            qs = self.qs.order_by(prefix + self.field, prefix + 'id')
+            if self.position is not None:
+                qs = self._seek(qs, desc)
+            content = list(qs[:self.per_page + 1])
+            self._more = len(content) > self.per_page
+            content = content[:self.per_page]
+            if self.backward:
+                content.reverse()
+            self._content = content
+        return self._content
+
+    def next_page_available(self):
+        if self.backward:
+            return bool(self.content)
+        return bool(self.content) and self._more
+
+    def prev_page_available(self):
+        if self.backward:
+            return bool(self.content) and self._more
+        return self.position is not None
+
+    def next_cursor(self):
+        if self.next_page_available() and self.content:
+            return self.encode(self.content[-1], False)
+
+    def prev_cursor(self):
+        if self.prev_page_available() and self.content:
+            return self.encode(self.content[0], True)
+
+    def content_json(self):
+        return map(to_json, self.content)
+
+    def __iter__(self):
+        for item in self.content:
+            yield item
+
+
+def paginated_json(fnc=None, cursor=False):
+    """Return paginated json, with cursor=True page is cursor from CursorPaginated"""
+    def decorator(fnc):
+        @wraps(fnc)
+        def wrapper(request, page=0, *args, **kwargs):
+            result = fnc(request, page, *args, **kwargs)
+            if cursor:
+                return to_json(CursorPaginated(result, page or None))
+            return to_json(Paginated(result, page))
+        return wrapper
+    if fnc is not None:
+        return decorator(fnc)
+    return decorator